@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+TOU_SLOT_NAMES = ['Peak', 'Standard', 'Off-peak']  # Eskom ToU slots 1, 2 and 3
+
+
+class SimulationResults:
+    # Running totals per level, accumulated while simulating from the pump statuses in the history buffers, so the
+    # per-second power series is never needed: pump-seconds per ToU slot (energy and cost follow from the pump power
+    # and tariff), pump starts and stops, level extremes and seconds outside limits.
+    # tariff is the cost per kWh in the peak, standard and off-peak ToU slots (no costs without one). Every time step
+    # in the history buffers counts as dt seconds
+    def __init__(self, pump_system, tariff=None, limits=(0, 100), dt=1):
+        if tariff is not None and len(tariff) != 3:
+            raise ValueError('Invalid tariff specified')
+        n_levels = len(pump_system.levels)
+        self.level_names = [level.name for level in pump_system.levels]
+        self.pump_power = np.array([level.pump_power for level in pump_system.levels], dtype=np.float64)
+        self.tariff = None if tariff is None else np.asarray(tariff, dtype=np.float64)
+        self.limits = tuple(limits)
+        self.dt = dt
+        self.seconds = 0
+        self.pump_seconds = np.zeros((n_levels, 3))
+        self.pump_starts = np.zeros(n_levels, dtype=np.int64)
+        self.pump_stops = np.zeros(n_levels, dtype=np.int64)
+        self.min_level = np.full(n_levels, np.inf)
+        self.max_level = np.full(n_levels, -np.inf)
+        self.level_violations = np.zeros(n_levels, dtype=np.int64)
+        self.violations = 0  # seconds that any level is outside limits
+
+    def add(self, pump_system, start, stop):
+        # account for time steps start up to stop, which must be in the history buffers. Switches are counted from
+        # the step before start
+        tou = pump_system.eskom_tou[start:stop]
+        outside_limits = np.zeros(stop - start, dtype=np.bool_)
+        for i, level in enumerate(pump_system.levels):
+            first = start - level.history_offset
+            previous = max(first - 1, 0)
+            statuses = level.pump_status_history[previous:stop - level.history_offset].astype(np.int64)
+            self.pump_seconds[i] += np.bincount(tou, weights=statuses[first - previous:], minlength=4)[1:4] * self.dt
+
+            changes = np.diff(statuses)
+            self.pump_starts[i] += changes[changes > 0].sum()
+            self.pump_stops[i] -= changes[changes < 0].sum()
+
+            levels = level.level_history[first:stop - level.history_offset]
+            self.min_level[i] = min(self.min_level[i], levels.min())
+            self.max_level[i] = max(self.max_level[i], levels.max())
+            outside = (levels < self.limits[0]) | (levels > self.limits[1])
+            self.level_violations[i] += outside.sum() * self.dt
+            outside_limits |= outside
+        self.violations += int(outside_limits.sum()) * self.dt
+        self.seconds += (stop - start) * self.dt
+
+    def get_energy(self):
+        # kWh per level (rows) and ToU slot (columns peak, standard, off-peak)
+        return self.pump_seconds * self.pump_power[:, np.newaxis] / 3600
+
+    def get_cost(self):
+        if self.tariff is None:
+            raise ValueError('Invalid cost query, no tariff was specified')
+        return self.get_energy() * self.tariff
+
+    def summary(self):
+        # one row per level and a total row (seconds any level is outside limits, for violations)
+        energy = self.get_energy()
+        columns = {}
+        for j, slot in enumerate(TOU_SLOT_NAMES):
+            columns['{} energy [kWh]'.format(slot)] = energy[:, j]
+        columns['Energy [kWh]'] = energy.sum(axis=1)
+        if self.tariff is not None:
+            cost = self.get_cost()
+            for j, slot in enumerate(TOU_SLOT_NAMES):
+                columns['{} cost'.format(slot)] = cost[:, j]
+            columns['Cost'] = cost.sum(axis=1)
+        columns['Pump starts'] = self.pump_starts
+        columns['Pump stops'] = self.pump_stops
+        for name, values in columns.items():
+            columns[name] = np.append(values, values.sum())
+        columns['Violations [s]'] = np.append(self.level_violations, self.violations)
+        columns['Min level'] = np.append(self.min_level, self.min_level.min(initial=np.inf))
+        columns['Max level'] = np.append(self.max_level, self.max_level.max(initial=-np.inf))
+        return pd.DataFrame(columns, index=pd.Index(self.level_names + ['Total'], name='Level'))
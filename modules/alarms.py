@@ -0,0 +1,205 @@
+import datetime
+import logging
+
+import numpy as np
+import pandas as pd
+
+from .horizon import get_start
+
+# Events come in pairs of an alarm or interlock becoming active and clearing, except pump starts and stops
+EVENT_TYPES = ['Pump start', 'Pump stop', 'High level', 'High level cleared', 'Low level', 'Low level cleared',
+               'Interlock', 'Interlock released']
+STATES = {'High level': 2, 'Low level': 4, 'Interlock': 6}  # alarm: event type index, the cleared type follows it
+EVENT_DTYPE = np.dtype([('second', np.int64), ('level', np.int16), ('type', np.int8), ('value', np.float64)])
+EVENTS_ONLY_CHUNK_SECONDS = 3600  # history kept in events-only simulations, see PumpSystem.perform_simulation
+
+
+class EventLog:
+    # Compact stream of events, collected chunk by chunk while simulating (like accounting.SimulationResults):
+    # - pump starts and stops, with the number of pumps started or stopped
+    # - high and low level alarms (a level above high_levels or below low_levels) and their clearing, with the level
+    # - the UL_100 interlock (the level pumped to is full, 1-factor and 2-factor) engaging and releasing, with the
+    #   level of the dam pumped to
+    # Thresholds are one value for all levels or a dict of level name: value. High levels default to the UL_HL of the
+    # levels pumping into a dam, 100 for the others. Run time per pump is accumulated as well
+    def __init__(self, high_levels=None, low_levels=0.0):
+        self.high_levels = high_levels
+        self.low_levels = low_levels
+        self.level_names = []
+        self.dt = 1
+        self.start_time = None
+
+    def start(self, pump_system, horizon, params):
+        # clear the log for a simulation with params from controller.lower
+        levels = pump_system.levels
+        self.level_names = [level.name for level in levels]
+        self.dt = horizon.dt
+        if horizon.start_date is None:
+            self.start_time = None
+        else:
+            date, start_second = get_start(horizon.start_date)
+            self.start_time = datetime.datetime.combine(date, datetime.time()) + datetime.timedelta(
+                seconds=start_second)
+
+        high_levels = np.full(len(levels), np.inf)
+        for i, level in enumerate(levels):
+            j = pump_system.upstream_index[i]
+            if j >= 0:
+                high_levels[j] = min(high_levels[j], level.UL_HL)
+        high_levels[np.isinf(high_levels)] = 100.0
+        self.high = self._get_thresholds(self.high_levels, high_levels)
+        self.low = self._get_thresholds(self.low_levels, np.zeros(len(levels)))
+
+        # the interlock of the schedule controllers, see controllers.decide_schedule
+        self.interlock = hasattr(params, 'UL_100')
+        if self.interlock:
+            self.upstream = np.asarray(params.upstream)
+            self.UL_LL = np.asarray(params.UL_LL)
+            self.UL_HL = np.asarray(params.UL_HL)
+        states = np.zeros((len(levels), len(STATES)), dtype=np.bool_)
+        if self.interlock:
+            states[:, 2] = params.UL_100
+        self.states = states  # high level, low level and interlock of the latest step
+
+        self.chunks = []
+        self.run_time = np.zeros((len(levels), 0))  # seconds each pump (columns) ran
+        self.seconds = 0
+        self.end_second = 0
+
+    def _get_thresholds(self, thresholds, default):
+        if thresholds is None:
+            return default
+        if isinstance(thresholds, dict):
+            return np.array([thresholds.get(name, value) for name, value in zip(self.level_names, default)],
+                            dtype=np.float64)
+        return np.full(len(self.level_names), thresholds, dtype=np.float64)
+
+    def add(self, pump_system, start, stop):
+        # events of time steps start up to stop, which must be in the history buffers with the step before start
+        # (unless start is 0)
+        steps = np.arange(start, stop)
+        events = []
+        for i, level in enumerate(pump_system.levels):
+            first = start - level.history_offset
+            previous = max(first - 1, 0)
+            statuses = level.pump_status_history[previous:stop - level.history_offset].astype(np.int64)
+            values = level.level_history[first:stop - level.history_offset]
+
+            changes = np.diff(statuses, prepend=statuses[:1])[-len(steps):]
+            events.append(self._get_events(i, steps, changes > 0, changes, 0))
+            events.append(self._get_events(i, steps, changes < 0, -changes, 1))
+
+            run_time = np.cumsum(np.bincount(statuses[-len(steps):])[::-1])[::-1][1:] * self.dt
+            if len(run_time) > self.run_time.shape[1]:
+                self.run_time = np.pad(self.run_time, ((0, 0), (0, len(run_time) - self.run_time.shape[1])))
+            self.run_time[i, :len(run_time)] += run_time
+
+            events += self._get_state_events(i, steps, values > self.high[i], values, 0)
+            events += self._get_state_events(i, steps, values < self.low[i], values, 1)
+
+            if self.interlock and stop > 1:
+                # decided from the level pumped to in the step before
+                decided = steps[steps >= 1]
+                j = self.upstream[i]
+                if j < 0:
+                    upper = np.full(len(decided), 45.0)
+                else:
+                    upper_level = pump_system.levels[j]
+                    upper = upper_level.level_history[decided[0] - 1 - upper_level.history_offset:
+                                                      decided[-1] - upper_level.history_offset]
+                engage = upper >= self.UL_HL[i]
+                release = upper <= self.UL_LL[i]
+                changed = engage | release
+                last = np.maximum.accumulate(np.where(changed, np.arange(len(decided)), -1))
+                engaged = np.where(last >= 0, ~release[last] & engage[last], self.states[i, 2])
+                events += self._get_state_events(i, decided, engaged, upper, 2)
+
+        self.chunks.append(np.concatenate(events))
+        self.seconds += len(steps) * self.dt
+        self.end_second = stop * self.dt
+
+    def _get_events(self, i, steps, mask, values, event_type):
+        events = np.zeros(np.count_nonzero(mask), dtype=EVENT_DTYPE)
+        events['second'] = steps[mask] * self.dt
+        events['level'] = i
+        events['type'] = event_type
+        events['value'] = values[mask]
+        return events
+
+    def _get_state_events(self, i, steps, active, values, state):
+        # events where active changes from the latest step before steps
+        previous = np.concatenate([self.states[i, state:state + 1], active[:-1]])
+        self.states[i, state] = active[-1]
+        event_type = list(STATES.values())[state]
+        return [self._get_events(i, steps, active & ~previous, values, event_type),
+                self._get_events(i, steps, ~active & previous, values, event_type + 1)]
+
+    @property
+    def events(self):
+        # all events, in order of time
+        events = np.concatenate(self.chunks) if self.chunks else np.zeros(0, dtype=EVENT_DTYPE)
+        return events[np.argsort(events['second'], kind='stable')]
+
+    @property
+    def nbytes(self):
+        return sum([chunk.nbytes for chunk in self.chunks])
+
+    def to_frame(self):
+        # one row per event, with the time of day if the simulation had a start date
+        events = self.events
+        df = pd.DataFrame({'Second': events['second'], 'Level': np.array(self.level_names)[events['level']],
+                           'Event': np.array(EVENT_TYPES)[events['type']], 'Value': events['value']})
+        if self.start_time is not None:
+            df.insert(1, 'Time', pd.Timestamp(self.start_time) + pd.to_timedelta(df['Second'], unit='s'))
+        return df
+
+    def write(self, path):
+        self.to_frame().to_csv(path, index=False)
+        logging.info('{} events written to {}.'.format(len(self.events), path))
+
+    def count(self, event='Pump start', period=3600):
+        # sum of the values of event (e.g. the number of pumps started) per level (columns) and period of seconds
+        # (rows, by their first second)
+        if event not in EVENT_TYPES:
+            raise ValueError('Invalid event type {}'.format(event))
+        events = self.events
+        events = events[events['type'] == EVENT_TYPES.index(event)]
+        n_periods = max(-(-self.end_second // period), 1)
+        counts = np.zeros((n_periods, len(self.level_names)))
+        np.add.at(counts, (events['second'] // period, events['level']), events['value'])
+        return pd.DataFrame(counts, columns=self.level_names,
+                            index=pd.Index(np.arange(n_periods) * period, name='Second'))
+
+    def get_durations(self, alarm='High level'):
+        # seconds each level spent with alarm ('High level', 'Low level' or 'Interlock') active
+        if alarm not in STATES:
+            raise ValueError('Invalid alarm {}'.format(alarm))
+        events = self.events
+        durations = np.zeros(len(self.level_names))
+        for i in range(len(self.level_names)):
+            on = events['second'][(events['level'] == i) & (events['type'] == STATES[alarm])]
+            off = events['second'][(events['level'] == i) & (events['type'] == STATES[alarm] + 1)]
+            if len(off) < len(on):  # still active at the end
+                off = np.append(off, self.end_second)
+            durations[i] = (off - on).sum()
+        return pd.Series(durations, index=pd.Index(self.level_names, name='Level'), name=alarm)
+
+    def get_run_time(self):
+        # seconds each pump ran, pump 1 being the first to start
+        return pd.DataFrame(self.run_time, columns=['Pump {}'.format(p + 1) for p in range(self.run_time.shape[1])],
+                            index=pd.Index(self.level_names, name='Level'))
+
+    def summary(self):
+        # one row per level
+        events = self.events
+        n_levels = len(self.level_names)
+        df = pd.DataFrame(index=pd.Index(self.level_names, name='Level'))
+        for event in ['Pump start', 'Pump stop']:
+            starts = events[events['type'] == EVENT_TYPES.index(event)]
+            df[event + 's'] = np.bincount(starts['level'], starts['value'], n_levels)
+        for alarm, event_type in STATES.items():
+            df['{} events'.format(alarm)] = np.bincount(events['level'][events['type'] == event_type],
+                                                        minlength=n_levels)
+            df['{} [s]'.format(alarm)] = self.get_durations(alarm).values
+        df['Pump run time [s]'] = self.run_time.sum(axis=1)
+        return df
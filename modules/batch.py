@@ -0,0 +1,187 @@
+import logging
+import time
+
+import numpy as np
+
+from . import controllers, kernels
+
+
+class BatchPumpSystem:
+    # n_scenarios copies of a pump system, simulated in lockstep. The state carries a leading scenario axis
+    # (levels are n_scenarios x n_levels), so one interpreter loop advances every scenario by a second at a time.
+    # Scenarios can differ in initial levels, inflow scaling (per scenario, per level or per half-hour block, e.g.
+    # Monte-Carlo inflow realisations) and schedule tables (n_scenarios x levels x pumps x ToU)
+    def __init__(self, pump_system, n_scenarios, initial_levels=None, inflow_scale=None, schedule_tables=None):
+        self.pump_system = pump_system
+        self.name = pump_system.name
+        self.n_scenarios = n_scenarios
+        n_levels = len(pump_system.levels)
+
+        if initial_levels is None:
+            initial_levels = [level.initial_level for level in pump_system.levels]
+        self.initial_levels = np.broadcast_to(np.asarray(initial_levels, dtype=np.float64),
+                                              (n_scenarios, n_levels)).copy()
+        self.initial_pumps = np.broadcast_to([level.initial_pumps_status for level in pump_system.levels],
+                                             (n_scenarios, n_levels)).astype(np.int64)
+
+        # (n_scenarios, 1), (n_scenarios, n_levels) or (n_scenarios, n_levels, half-hour blocks)
+        inflow_scale = np.ones(n_scenarios) if inflow_scale is None else np.asarray(inflow_scale, dtype=np.float64)
+        self.inflow_scale = inflow_scale[:, np.newaxis] if inflow_scale.ndim == 1 else inflow_scale
+        self.schedule_tables = schedule_tables
+
+        self.level_history = None
+        self.pump_status_history = None
+        self.throughput = None
+        logging.info('{} batch of {} scenarios created.'.format(self.name, n_scenarios))
+
+    def perform_simulation(self, mode, seconds=86400, start_date=None, holidays=None, store_history=False,
+                           limits=(0, 100), observer=None, observe_every=1800):
+        # Running results per scenario: final levels and pumps, min/max levels, energy per ToU slot (kWh, columns
+        # peak, standard, off-peak) and seconds any level is outside limits. store_history keeps the full
+        # (n_scenarios x n_levels x seconds) histories as well.
+        # observer(t, batch) is called every observe_every seconds, with the running results up to second t. It may
+        # return a boolean mask of the scenarios to keep: the others are terminated early, their results stay as they
+        # were at second t and terminated holds that second (-1 for scenarios that ran to the end). With an observer,
+        # window_min_level and window_max_level hold the level extremes since the previous observation as well
+        if mode not in ['1-factor', '2-factor', 'validation']:
+            raise ValueError('Invalid batch simulation mode specified')
+        logging.info('{} batch simulation started in {} mode.'.format(self.name, mode))
+        start_time = time.time()
+
+        pump_system = self.pump_system
+        horizon = pump_system.get_horizon(seconds, start_date, holidays)
+        arrays = kernels.lower_pump_system(pump_system, horizon)
+        # the decisions are vectorised over the scenarios here, on the parameters of the built-in controllers
+        control = controllers.get_controller('1-factor' if mode == 'validation' else mode).lower(pump_system, horizon)
+        if mode == 'validation':
+            validation = controllers.ValidationController().lower(pump_system, horizon).validation
+        n = self.n_scenarios
+        n_levels = len(pump_system.levels)
+        level_index = np.arange(n_levels)
+
+        schedule = control.schedule if self.schedule_tables is None else np.asarray(self.schedule_tables,
+                                                                                     dtype=np.float64)
+        n_pumps = schedule.shape[-2]
+        pump_index = np.arange(n_pumps)
+        in_schedule = pump_index < control.max_pumps[:, np.newaxis]  # (levels, pumps)
+        has_pumps = control.max_pumps >= 1
+        pump_power = np.array([level.pump_power for level in pump_system.levels], dtype=np.float64)
+        # feeds are added in level order, using this second's outflow for levels that come earlier
+        feeds = [(l, arrays['feed_index'][k]) for l in range(n_levels)
+                 for k in range(arrays['feed_start'][l], arrays['feed_start'][l + 1])]
+        upstream = control.upstream
+        upper_from_upstream = upstream >= 0
+
+        levels = self.initial_levels.copy()
+        pumps = self.initial_pumps.copy()
+        UL_100 = np.broadcast_to(control.UL_100, (n, n_levels)).copy()
+        outflow = np.zeros((n, n_levels))  # as after PumpSystem.reset_pumpsystem_state
+        inflow_scale = self.inflow_scale
+
+        # running results of the active scenarios, written back to the full arrays for the observer and at the end
+        self.active = np.arange(n)
+        self.terminated = np.full(n, -1, dtype=np.int64)
+        min_level = levels.copy()
+        max_level = levels.copy()
+        energy = np.zeros((n, 3))
+        violations = np.zeros(n, dtype=np.int64)
+        energy[:, horizon.eskom_tou.item(0) - 1] += pumps @ pump_power / 3600
+        violations += ((levels < limits[0]) | (levels > limits[1])).any(axis=1)
+        self.min_level = min_level.copy()
+        self.max_level = max_level.copy()
+        self.energy = energy.copy()
+        self.violations = violations.copy()
+        self.levels = levels.copy()
+        self.pumps = pumps.copy()
+        self.window_min_level = levels.copy()
+        self.window_max_level = levels.copy()
+        window_min, window_max = levels.copy(), levels.copy()
+        if store_history:
+            self.level_history = np.empty((n, n_levels, seconds))
+            self.pump_status_history = np.empty((n, n_levels, seconds), dtype=np.int8)
+            self.level_history[:, :, 0] = levels
+            self.pump_status_history[:, :, 0] = pumps
+
+        for t in range(1, seconds):
+            if observer is not None and t % observe_every == 0 and len(self.active) > 0:
+                self._store_results(levels, pumps, min_level, max_level, energy, violations, window_min, window_max)
+                keep = observer(t - 1, self)
+                keep = None if keep is None else np.asarray(keep, dtype=np.bool_)[self.active]
+                if keep is not None and not keep.all():
+                    self.terminated[self.active[~keep]] = t - 1
+                    self.active = self.active[keep]
+                    levels, pumps, UL_100, outflow = levels[keep], pumps[keep], UL_100[keep], outflow[keep]
+                    min_level, max_level, energy, violations = min_level[keep], max_level[keep], energy[keep], \
+                        violations[keep]
+                    inflow_scale = inflow_scale[keep]
+                    window_min, window_max = window_min[keep], window_max[keep]
+                    if schedule.ndim == 4:
+                        schedule = schedule[keep]
+                    n = len(self.active)
+                    if n == 0:
+                        break
+                window_min, window_max = levels.copy(), levels.copy()
+
+            block = horizon.block_index.item(t)
+            tou_time_slot = horizon.eskom_tou.item(t)
+
+            if mode == 'validation':
+                pumps_required = np.broadcast_to(validation[:, t], (n, n_levels)).astype(np.int64)
+            else:
+                upper_dam_level = np.where(upper_from_upstream, levels[:, upstream], 45.0)
+                UL_100 |= upper_dam_level >= control.UL_HL
+                UL_100 &= ~(upper_dam_level <= control.UL_LL)
+
+                # the schedule table thresholds of this ToU slot, compared for every scenario, level and pump at once
+                thresholds = schedule[..., tou_time_slot - 1]
+                above = (levels[:, :, np.newaxis] >= thresholds) & in_schedule
+                any_above = above.any(axis=2)
+                highest = n_pumps - np.argmax(above[:, :, ::-1], axis=2)
+                pumps_required_temp = np.where(any_above, highest, pumps)
+                too_low = (levels < thresholds[..., 0] - control.hysteresis) & has_pumps
+
+                pumps_required = np.where(too_low, 0, pumps)
+                pumps_required = np.where(pumps_required >= pumps_required_temp + 2, pumps_required_temp + 1,
+                                          pumps_required)
+                pumps_required = np.where(any_above & ~too_low & (pumps_required_temp > pumps_required),
+                                          pumps_required_temp, pumps_required)
+                pumps_required = np.where(UL_100, 0, pumps_required)
+
+            previous_outflow = outflow
+            pumps = pumps_required
+            outflow = pumps * arrays['pump_flow']
+
+            additional_in_flow = np.zeros((n, n_levels))
+            for l, j in feeds:
+                additional_in_flow[:, l] += outflow[:, j] if j < l else previous_outflow[:, j]
+
+            inflow_row = np.where(arrays['inflow_pump_dependent'], pumps, 0)
+            inflow = arrays['inflow_table'][level_index, inflow_row, block]
+            inflow = inflow * (inflow_scale if inflow_scale.ndim == 2 else inflow_scale[:, :, block])
+
+            levels = levels + 100 / arrays['capacity'] * (inflow + additional_in_flow - outflow)
+
+            np.minimum(min_level, levels, out=min_level)
+            np.maximum(max_level, levels, out=max_level)
+            if observer is not None:
+                np.minimum(window_min, levels, out=window_min)
+                np.maximum(window_max, levels, out=window_max)
+            energy[:, tou_time_slot - 1] += pumps @ pump_power / 3600
+            violations += ((levels < limits[0]) | (levels > limits[1])).any(axis=1)
+            if store_history:
+                rows = slice(None) if n == self.n_scenarios else self.active
+                self.level_history[rows, :, t] = levels
+                self.pump_status_history[rows, :, t] = pumps
+
+        self._store_results(levels, pumps, min_level, max_level, energy, violations, window_min, window_max)
+        elapsed = time.time() - start_time
+        self.throughput = n * seconds / elapsed  # scenario-seconds per wall-second
+        logging.info('{} batch simulation completed in {} mode ({:.0f} scenario-seconds per second).'.format(
+            self.name, mode, self.throughput))
+
+    def _store_results(self, levels, pumps, min_level, max_level, energy, violations, window_min, window_max):
+        # write the running results of the active scenarios back to the full result arrays
+        for result, values in [(self.levels, levels), (self.pumps, pumps), (self.min_level, min_level),
+                               (self.max_level, max_level), (self.energy, energy), (self.violations, violations),
+                               (self.window_min_level, window_min), (self.window_max_level, window_max)]:
+            result[self.active] = values
@@ -0,0 +1,198 @@
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import platform
+import runpy
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows, peak RSS is then not measured
+    resource = None
+
+SIMULATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'simulations')
+
+# simulation script (relative to SIMULATIONS_DIRECTORY) and modes of every case, those of its committed outputs
+CASES = {'CS1': ('Case_study_1/simulation_CS1.py', ['validation', '1-factor', '2-factor', 'n-factor']),
+         'CS2': ('Case_study_2/simulation_CS2.py', ['validation', '1-factor', '2-factor', 'n-factor']),
+         'CS3': ('Case_study_3/simulation_CS3.py', ['validation', '1-factor', '2-factor', 'n-factor']),
+         'M1': ('Verification/Part 1/simulation_M1.py', ['1-factor']),
+         'M2': ('Verification/Part 1/simulation_M2.py', ['1-factor']),
+         'M3': ('Verification/Part 1/simulation_M3.py', ['1-factor']),
+         'D1': ('Verification/Part 2/simulation_D1.py', ['1-factor']),
+         'D2': ('Verification/Part 2/simulation_D2.py', ['n-factor'])}
+HORIZON_DAYS = [1, 7, 30]
+VALIDATION_DAYS = 1  # the SCADA pump statuses only cover one day
+EQUIVALENCE_TOLERANCE = 1e-9  # largest level difference from the committed outputs
+BENCHMARK_KEYS = ['Case', 'Mode', 'Days', 'Engine', 'Integrator']
+
+
+def load_pump_system(case):
+    # the pump system a simulation script builds, without running its simulations
+    script = os.path.join(SIMULATIONS_DIRECTORY, CASES[case][0])
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(script))  # inputs are read relative to the script
+    try:
+        return runpy.run_path(os.path.basename(script), run_name='benchmark')['pump_system']
+    finally:
+        os.chdir(cwd)
+
+
+def get_output_path(case, mode):
+    # committed output of the simulation script
+    directory = os.path.dirname(os.path.join(SIMULATIONS_DIRECTORY, CASES[case][0]))
+    return os.path.join(directory, 'output', '{}_simulation_data_export_{}.csv.gz'.format(case, mode))
+
+
+def check_equivalence(pump_system, path):
+    # largest level difference and number of pump status differences from the output in path, over the seconds both
+    # cover
+    df = pd.read_csv(path, float_precision='round_trip')
+    n = min(len(df), pump_system.levels[0].history_length)
+    max_deviation = 0.0
+    mismatches = 0
+    for level in pump_system.levels:
+        levels = level.get_level_history()[:n]
+        statuses = level.get_pump_status_history()[:n]
+        max_deviation = max(max_deviation, np.abs(levels - df[level.name + ' Level'].values[:n]).max())
+        mismatches += int((statuses != df[level.name + ' Status'].values[:n]).sum())
+    return max_deviation, mismatches
+
+
+def get_peak_rss():
+    # peak resident set size of this process in MB
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, kB elsewhere
+
+
+def run_benchmark(case, mode, days, engine='python', integrator='fixed', repeat=1):
+    # Time one simulation (the best of repeat runs) after a short warm-up run, which loads or compiles the jit
+    # kernels. The first day of the last run is compared with the committed output, which checks that runs start from
+    # the initial state. Run in a fresh process (see run_suite) for the peak RSS to be that of this benchmark only
+    pump_system = load_pump_system(case)
+    seconds = days * 86400
+    pump_system.perform_simulation(mode, seconds=2, engine=engine, integrator=integrator)
+
+    wall_time = np.inf
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        pump_system.perform_simulation(mode, seconds=seconds, engine=engine, integrator=integrator)
+        wall_time = min(wall_time, time.perf_counter() - start_time)
+
+    row = {'Case': case, 'Mode': mode, 'Days': days, 'Engine': engine, 'Integrator': integrator,
+           'Wall time [s]': wall_time, 'Peak RSS [MB]': get_peak_rss(),
+           'Simulated seconds per second': seconds / wall_time}
+    path = get_output_path(case, mode)
+    if os.path.exists(path):
+        max_deviation, mismatches = check_equivalence(pump_system, path)
+        row.update({'Max level deviation': max_deviation, 'Status mismatches': mismatches,
+                    'Equivalent': bool(max_deviation <= EQUIVALENCE_TOLERANCE and mismatches == 0)})
+    return row
+
+
+def _run_benchmark(task):
+    logging.disable(logging.WARNING)  # the simulation logs would interleave with those of the suite
+    return run_benchmark(*task)
+
+
+def get_benchmarks(cases=None, modes=None, days=None, engines=('python',), integrators=('fixed',)):
+    # (case, mode, days, engine, integrator) of every benchmark, validation only over the days it has data for
+    benchmarks = []
+    for case in CASES if cases is None else cases:
+        if case not in CASES:
+            raise ValueError('Invalid benchmark case {}'.format(case))
+        for mode in CASES[case][1]:
+            if modes is not None and mode not in modes:
+                continue
+            for n_days in HORIZON_DAYS if days is None else days:
+                if mode == 'validation' and n_days > VALIDATION_DAYS:
+                    continue
+                for engine in engines:
+                    for integrator in integrators:
+                        benchmarks.append((case, mode, n_days, engine, integrator))
+    return benchmarks
+
+
+def run_suite(benchmarks, repeat=1):
+    # every benchmark in a fresh worker process, one at a time so they do not compete for the CPU
+    rows = []
+    with concurrent.futures.ProcessPoolExecutor(1, max_tasks_per_child=1) as executor:
+        for benchmark, row in zip(benchmarks, executor.map(_run_benchmark, [b + (repeat,) for b in benchmarks])):
+            logging.info('{} {} {} days ({} engine, {} integrator): {:.2f} s.'.format(*benchmark,
+                                                                                    row['Wall time [s]']))
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def get_environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SIMULATIONS_DIRECTORY,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        import numba
+        numba_version = numba.__version__
+    except ImportError:
+        numba_version = None
+    return {'Date': datetime.datetime.now().isoformat(timespec='seconds'), 'Commit': commit,
+            'Machine': platform.node(), 'Python': platform.python_version(), 'numpy': np.__version__,
+            'numba': numba_version}
+
+
+def append_history(path, results, environment=None):
+    # the history is a JSON list of runs, each with its environment and results
+    history = load_history(path)
+    run = get_environment() if environment is None else environment
+    run['Results'] = json.loads(results.to_json(orient='records'))
+    history.append(run)
+    with open(path, 'w') as f:
+        json.dump(history, f, indent=1)
+    return history
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    # results replace those of the same benchmarks in the baseline, if there is one
+    if os.path.exists(path):
+        baseline = load_baseline(path)
+        keys = BENCHMARK_KEYS
+        kept = baseline.merge(results[keys], on=keys, how='left', indicator=True)['_merge'] == 'left_only'
+        results = pd.concat([baseline[kept.values], results], ignore_index=True)
+    with open(path, 'w') as f:
+        json.dump(dict(get_environment(), Results=json.loads(results.to_json(orient='records'))), f, indent=1)
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return pd.DataFrame(json.load(f)['Results'])
+
+
+def compare_with_baseline(results, baseline, threshold=0.2, memory_threshold=0.2):
+    # results next to the baseline ones of the same benchmarks. A benchmark regressed when its wall time or peak RSS
+    # grew by more than threshold or memory_threshold (fractions of the baseline), or when it is no longer
+    # equivalent to the committed output
+    keys = BENCHMARK_KEYS
+    df = results.merge(baseline[keys + ['Wall time [s]', 'Peak RSS [MB]']], on=keys, how='left',
+                       suffixes=('', ' baseline'))
+    df['Wall time change'] = df['Wall time [s]'] / df['Wall time [s] baseline'] - 1
+    df['Peak RSS change'] = df['Peak RSS [MB]'] / df['Peak RSS [MB] baseline'] - 1
+    df['Regressed'] = (df['Wall time change'] > threshold) | (df['Peak RSS change'] > memory_threshold)
+    if 'Equivalent' in df:
+        df['Regressed'] |= df['Equivalent'].eq(False)  # cases without committed outputs are not checked
+    return df
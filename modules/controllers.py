@@ -0,0 +1,425 @@
+import collections
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # numba is optional, the controllers then decide in plain Python
+    numba = None
+
+NO_CHANGE = -np.inf  # n-factor last change before any pump was switched ('000' on the pumping level)
+
+# comparison operators of n-factor rule conditions, and the quantities they compare
+RULE_OPERATORS = {'<': 0, '<=': 1, '>': 2, '>=': 3, '==': 4, '!=': 5}
+RULE_TIME = -1  # second of the day, 0 at midnight
+RULE_TOU = -2  # ToU slot, 1 = peak, 2 = standard, 3 = off-peak
+
+# Site specific n-factor rules of case study 3. Before each level decides, the rules of that level are applied in
+# order: a rule sets the level's n_mode_max_pumps when all its conditions hold. A condition compares the level (in
+# the previous second) of the named pumping level, 'time' (the second of the day) or 'tou' with a value, which can
+# also name an attribute of the ruled level. max_pumps can name another level, to take its n_mode_max_pumps of this
+# second
+CS3_N_FACTOR_RULES = [
+    {'level': '31L', 'conditions': [('20L', '>', 70)], 'max_pumps': 1},
+    {'level': '31L', 'conditions': [('20L', '<', 60)], 'max_pumps': 2},
+    {'level': '31L', 'conditions': [('31L', '>=', 'n_mode_max_level'), ('time', '<', 42900)], 'max_pumps': 2},
+    {'level': '20L', 'conditions': [('tou', '==', 1), ('20L', '<', 75)], 'max_pumps': 1},
+    {'level': '20L', 'conditions': [('tou', '==', 1), ('20L', '<', 60)], 'max_pumps': 0},
+    {'level': '20L', 'conditions': [('tou', '==', 1), ('20L', '>', 80)], 'max_pumps': 1},
+    {'level': '20L', 'conditions': [('tou', '!=', 1)], 'max_pumps': 2},
+    {'level': 'IPC', 'conditions': [('tou', '==', 1)], 'max_pumps': '20L'},
+    {'level': 'IPC', 'conditions': [('tou', '==', 1), ('IPC', '>', 90)], 'max_pumps': 1},
+    {'level': 'IPC', 'conditions': [('tou', '!=', 1), ('Surface', '<', 90), ('time', '<', 39600)], 'max_pumps': 3},
+    {'level': 'IPC', 'conditions': [('tou', '!=', 1), ('IPC', '>', 80), ('time', '>', 39600), ('time', '<', 64800)],
+     'max_pumps': 3},
+    {'level': 'IPC', 'conditions': [('tou', '!=', 1), ('Surface', '<', 90), ('time', '>', 57600)], 'max_pumps': 3},
+    {'level': 'IPC', 'conditions': [('tou', '!=', 1), ('Surface', '>=', 95), ('time', '<', 39600)], 'max_pumps': 2},
+    {'level': 'IPC', 'conditions': [('tou', '!=', 1), ('Surface', '>=', 97.5), ('IPC', '<', 60)], 'max_pumps': 1},
+    {'level': 'IPC', 'conditions': [('tou', '!=', 1), ('IPC', '<', 50), ('Surface', '>=', 90), ('time', '>', 39600)],
+     'max_pumps': 1},
+    {'level': 'IPC', 'conditions': [('tou', '!=', 1), ('time', '>', 70200)], 'max_pumps': 2},
+    {'level': 'IPC', 'conditions': [('tou', '!=', 1), ('time', '>', 77400)], 'max_pumps': 3},
+    {'level': 'IPC', 'conditions': [('tou', '!=', 1), ('time', '>', 81000)], 'max_pumps': 2},
+]
+
+# evaluations counts, per level, the seconds decide compared the level with its thresholds while
+# count_evaluations[0] is set (only while instrumented, see profiling.Instrumentation)
+ScheduleParameters = collections.namedtuple('ScheduleParameters', [
+    'schedule', 'hysteresis', 'max_pumps', 'upstream', 'UL_LL', 'UL_HL', 'UL_100', 'evaluations',
+    'count_evaluations'])
+NFactorParameters = collections.namedtuple('NFactorParameters', [
+    'lower_bound', 'upper_bound', 'bottom_offset', 'top_offset', 'min_pumps', 'max_pumps', 'last_change',
+    'rule_start', 'rule_max_pumps', 'rule_copy', 'condition_start', 'condition_quantity', 'condition_operator',
+    'condition_value', 'second_of_day', 'evaluations', 'count_evaluations'])
+ValidationParameters = collections.namedtuple('ValidationParameters', ['validation', 'evaluations',
+                                                                       'count_evaluations'])
+
+
+def _jit(func):
+    if numba is None:
+        return func
+    return numba.njit(cache=True)(func)
+
+
+def is_compiled(decide):
+    return numba is not None and isinstance(decide, numba.core.dispatcher.Dispatcher)
+
+
+@_jit
+def decide_schedule(t, tou_time_slot, previous_tou_time_slot, levels, statuses, pumps, params):
+    # 1-factor and 2-factor: pump schedule table thresholds, overridden while the level pumped to is full
+    for l in range(len(pumps)):
+        if params.upstream[l] < 0:
+            upper_dam_level = 45.0
+        else:
+            upper_dam_level = levels[params.upstream[l]]
+
+        if upper_dam_level >= params.UL_HL[l]:
+            params.UL_100[l] = True
+        if upper_dam_level <= params.UL_LL[l]:
+            params.UL_100[l] = False
+
+        if not params.UL_100[l]:
+            if params.count_evaluations[0] and params.max_pumps[l] > 0:
+                params.evaluations[l] += 1
+            pumps_required = statuses[l]
+            pumps_required_temp = pumps_required
+            do_next_check = False
+            dam_level = levels[l]
+
+            for p in range(1, params.max_pumps[l] + 1):
+                if dam_level >= params.schedule[l, p - 1, tou_time_slot - 1]:
+                    pumps_required_temp = p
+                    do_next_check = True
+                if dam_level < (params.schedule[l, 0, tou_time_slot - 1] - params.hysteresis[l]):
+                    pumps_required = 0
+                    do_next_check = False
+
+            if pumps_required >= (pumps_required_temp + 2):
+                pumps_required = pumps_required_temp + 1
+            if do_next_check:
+                if pumps_required_temp > pumps_required:
+                    pumps_required = pumps_required_temp
+        else:
+            pumps_required = 0
+
+        pumps[l] = pumps_required
+
+
+@_jit
+def _compare(value, operator, reference):
+    if operator == 0:
+        return value < reference
+    if operator == 1:
+        return value <= reference
+    if operator == 2:
+        return value > reference
+    if operator == 3:
+        return value >= reference
+    if operator == 4:
+        return value == reference
+    return value != reference
+
+
+@_jit
+def decide_n_factor(t, tou_time_slot, previous_tou_time_slot, levels, statuses, pumps, params):
+    # start or stop one pump at a time between the n-factor bounds of the ToU slot, after the site rules
+    for l in range(len(pumps)):
+        for r in range(params.rule_start[l], params.rule_start[l + 1]):
+            holds = True
+            for c in range(params.condition_start[r], params.condition_start[r + 1]):
+                quantity = params.condition_quantity[c]
+                if quantity == RULE_TIME:
+                    value = float(params.second_of_day[t])
+                elif quantity == RULE_TOU:
+                    value = float(tou_time_slot)
+                else:
+                    value = levels[quantity]
+                if not _compare(value, params.condition_operator[c], params.condition_value[c]):
+                    holds = False
+                    break
+            if holds:
+                if params.rule_copy[r] >= 0:
+                    params.max_pumps[l] = params.max_pumps[params.rule_copy[r]]
+                else:
+                    params.max_pumps[l] = params.rule_max_pumps[r]
+
+        prev_level = levels[l]
+        pump_change = 0
+        max_pumps = params.max_pumps[l]
+        if params.count_evaluations[0] and max_pumps > 0:
+            params.evaluations[l] += 1
+
+        for p in range(0, max_pumps):
+            # check if pumps should be switched on
+            check_lev = params.upper_bound[l, tou_time_slot] + p * params.top_offset[l]
+            if prev_level >= check_lev:
+                if check_lev != params.last_change[l]:
+                    pump_change = 1
+                    params.last_change[l] = check_lev
+                    break
+            # check if pumps should be switched off
+            check_lev2 = params.lower_bound[l, tou_time_slot] - p * params.bottom_offset[l]
+            if prev_level <= check_lev2:
+                if params.last_change[l] == NO_CHANGE or check_lev2 < params.last_change[l] or \
+                        tou_time_slot != previous_tou_time_slot:
+                    pump_change = -1
+                    params.last_change[l] = check_lev2
+                    break
+
+        pumps_required = statuses[l] + pump_change
+        if pumps_required < params.min_pumps[l]:
+            pumps_required = params.min_pumps[l]
+        elif pumps_required > max_pumps:
+            pumps_required = max_pumps
+        pumps[l] = pumps_required
+
+
+@_jit
+def decide_validation(t, tou_time_slot, previous_tou_time_slot, levels, statuses, pumps, params):
+    # the actual (SCADA) pump statuses
+    for l in range(len(pumps)):
+        pumps[l] = params.validation[l, t]
+
+
+class Controller:
+    # Decides the pump statuses of all levels every second.
+    # decide(t, tou_time_slot, previous_tou_time_slot, levels, statuses, pumps, params) reads the levels and pump
+    # statuses of all levels in second t - 1 and writes their pump statuses for second t into pumps. params is what
+    # lower returns (a namedtuple of arrays), including state kept between seconds. The jit engine runs decide
+    # compiled, when it is a numba function. params can count the seconds decide compared each level with its
+    # thresholds in an evaluations array, while the count_evaluations flag (an array of one) is set, for
+    # profiling.Instrumentation.
+    # Controllers that provide the levels and times at which decide can change its decision (get_critical_levels and
+    # get_time_events) and set can_jump run on the event integrator as well. Controllers whose params fix the pump
+    # statuses of every second in a validation array set can_replay, see validation.replay
+    name = 'custom'
+    can_jump = False
+    can_replay = False
+
+    def __init__(self, decide=None):
+        self.decide = decide
+
+    def lower(self, pump_system, horizon):
+        return ()
+
+    def load_state(self, pump_system, params):
+        # copy the control state of the pumping levels into params
+        pass
+
+    def store_state(self, pump_system, params):
+        # copy the control state in params back to the pumping levels
+        pass
+
+    def get_state(self, params):
+        # comparable snapshot of the control state in params
+        return ()
+
+    def set_state(self, params, state):
+        pass
+
+    def get_critical_levels(self, pump_system):
+        return [np.empty(0) for _ in pump_system.levels]
+
+    def get_time_events(self, pump_system, horizon, start, stop):
+        return np.empty(0, dtype=np.int64)
+
+
+class ScheduleController(Controller):
+    # 1-factor, or with upper level limits (the levels pumped to stop pumping while they are full) 2-factor
+    can_jump = True
+
+    def __init__(self, upper_level_limits=False):
+        Controller.__init__(self, decide_schedule)
+        self.upper_level_limits = upper_level_limits
+        self.name = '2-factor' if upper_level_limits else '1-factor'
+
+    def lower(self, pump_system, horizon):
+        levels = pump_system.levels
+        max_rows = max([len(level.pump_schedule_table) for level in levels])
+        schedule = np.zeros((len(levels), max_rows, 3))
+        for i, level in enumerate(levels):
+            table = np.asarray(level.pump_schedule_table, dtype=np.float64)
+            schedule[i, :table.shape[0], :table.shape[1]] = table
+
+        upstream = pump_system.upstream_index if self.upper_level_limits else np.full(len(levels), -1, dtype=np.int64)
+        return ScheduleParameters(schedule, np.array([level.hysteresis for level in levels], dtype=np.float64),
+                                  np.array([level.max_pumps for level in levels], dtype=np.int64), upstream,
+                                  np.array([level.UL_LL for level in levels], dtype=np.float64),
+                                  np.array([level.UL_HL for level in levels], dtype=np.float64),
+                                  np.array([level.UL_100 for level in levels], dtype=np.bool_),
+                                  np.zeros(len(levels), dtype=np.int64), np.zeros(1, dtype=np.bool_))
+
+    def load_state(self, pump_system, params):
+        for i, level in enumerate(pump_system.levels):
+            params.UL_100[i] = level.UL_100
+
+    def store_state(self, pump_system, params):
+        for i, level in enumerate(pump_system.levels):
+            level.set_UL_100(bool(params.UL_100[i]))
+
+    def get_state(self, params):
+        return tuple(params.UL_100)
+
+    def set_state(self, params, state):
+        params.UL_100[:] = state
+
+    def get_critical_levels(self, pump_system):
+        critical = [[] for _ in pump_system.levels]
+        for i, level in enumerate(pump_system.levels):
+            table = np.asarray(level.pump_schedule_table, dtype=np.float64)
+            critical[i].extend(table[:level.max_pumps].ravel())
+            critical[i].extend(table[0] - level.hysteresis)
+            if self.upper_level_limits and level.fed_to_level is not None:
+                critical[pump_system.upstream_index[i]].extend([level.UL_LL, level.UL_HL])
+        return [np.unique(np.array(c, dtype=np.float64)) for c in critical]
+
+
+class NFactorController(Controller):
+    # n-factor, with site specific rules (see CS3_N_FACTOR_RULES, the default) compiled into flat rule tables once
+    # per simulation. Rules of levels that are not in the pump system, or that refer to such levels, are left out
+    name = 'n-factor'
+    can_jump = True
+
+    def __init__(self, rules=None):
+        Controller.__init__(self, decide_n_factor)
+        self.rules = CS3_N_FACTOR_RULES if rules is None else rules
+
+    def compile_rules(self, pump_system):
+        # rule_start[i]:rule_start[i + 1] are the rules of level i, condition_start[r]:condition_start[r + 1] the
+        # conditions of rule r
+        rules = [[] for _ in pump_system.levels]
+        for rule in self.rules:
+            i = pump_system.level_index.get(rule['level'])
+            names = [quantity for quantity, _, _ in rule['conditions'] if quantity not in ['time', 'tou']]
+            if isinstance(rule['max_pumps'], str):
+                names.append(rule['max_pumps'])
+            if i is None or any([name not in pump_system.level_index for name in names]):
+                continue
+
+            conditions = []
+            for quantity, operator, value in rule['conditions']:
+                if operator not in RULE_OPERATORS:
+                    raise ValueError('Invalid n-factor rule operator {}'.format(operator))
+                quantity = {'time': RULE_TIME, 'tou': RULE_TOU}.get(quantity, pump_system.level_index.get(quantity))
+                value = getattr(pump_system.levels[i], value) if isinstance(value, str) else value
+                conditions.append((quantity, RULE_OPERATORS[operator], value))
+            if isinstance(rule['max_pumps'], str):
+                rules[i].append((-1, pump_system.level_index[rule['max_pumps']], conditions))
+            else:
+                rules[i].append((rule['max_pumps'], -1, conditions))
+
+        flat = [rule for level_rules in rules for rule in level_rules]
+        conditions = [condition for rule in flat for condition in rule[2]]
+        rule_start = np.zeros(len(rules) + 1, dtype=np.int64)
+        rule_start[1:] = np.cumsum([len(level_rules) for level_rules in rules])
+        condition_start = np.zeros(len(flat) + 1, dtype=np.int64)
+        condition_start[1:] = np.cumsum([len(rule[2]) for rule in flat])
+        return (rule_start, np.array([rule[0] for rule in flat], dtype=np.int64),
+                np.array([rule[1] for rule in flat], dtype=np.int64), condition_start,
+                np.array([c[0] for c in conditions], dtype=np.int64),
+                np.array([c[1] for c in conditions], dtype=np.int64),
+                np.array([c[2] for c in conditions], dtype=np.float64))
+
+    def lower(self, pump_system, horizon):
+        levels = pump_system.levels
+        lower_bound = np.zeros((len(levels), 4))
+        upper_bound = np.zeros((len(levels), 4))
+        for i, level in enumerate(levels):
+            for tou_time_slot in [1, 2, 3]:
+                lower_bound[i, tou_time_slot] = level.n_mode_lower_bound[tou_time_slot]
+                upper_bound[i, tou_time_slot] = level.n_mode_upper_bound[tou_time_slot]
+
+        params = NFactorParameters(lower_bound, upper_bound,
+                                   np.array([level.n_mode_bottom_offset for level in levels], dtype=np.float64),
+                                   np.array([level.n_mode_top_offset for level in levels], dtype=np.float64),
+                                   np.array([level.n_mode_min_pumps for level in levels], dtype=np.float64),
+                                   np.zeros(len(levels), dtype=np.int64), np.zeros(len(levels)),
+                                   *self.compile_rules(pump_system), horizon.second_of_day,
+                                   np.zeros(len(levels), dtype=np.int64), np.zeros(1, dtype=np.bool_))
+        self.load_state(pump_system, params)
+        return params
+
+    def load_state(self, pump_system, params):
+        for i, level in enumerate(pump_system.levels):
+            params.max_pumps[i] = level.n_mode_max_pumps
+            params.last_change[i] = NO_CHANGE if level.n_mode_last_change == '000' else level.n_mode_last_change
+
+    def store_state(self, pump_system, params):
+        for i, level in enumerate(pump_system.levels):
+            level.n_mode_max_pumps = int(params.max_pumps[i])
+            level.n_mode_last_change = '000' if params.last_change[i] == NO_CHANGE else float(params.last_change[i])
+
+    def get_state(self, params):
+        return tuple(params.max_pumps), tuple(params.last_change)
+
+    def set_state(self, params, state):
+        params.max_pumps[:] = state[0]
+        params.last_change[:] = state[1]
+
+    def get_critical_levels(self, pump_system):
+        _, rule_max_pumps, _, _, condition_quantity, _, condition_value = self.compile_rules(pump_system)
+        # the rules can raise n_mode_max_pumps up to the largest value they set
+        max_pumps = max([level.n_mode_max_pumps for level in pump_system.levels] + list(rule_max_pumps))
+        critical = [[] for _ in pump_system.levels]
+        for i, level in enumerate(pump_system.levels):
+            for tou_time_slot in [1, 2, 3]:
+                for p in range(max_pumps):
+                    critical[i].append(level.n_mode_upper_bound[tou_time_slot] + p * level.n_mode_top_offset)
+                    critical[i].append(level.n_mode_lower_bound[tou_time_slot] - p * level.n_mode_bottom_offset)
+        for quantity, value in zip(condition_quantity, condition_value):
+            if quantity >= 0:
+                critical[quantity].append(value)
+        return [np.unique(np.array(c, dtype=np.float64)) for c in critical]
+
+    def get_time_events(self, pump_system, horizon, start, stop):
+        # the time steps at which the time conditions of the rules change, every day
+        _, _, _, _, condition_quantity, _, condition_value = self.compile_rules(pump_system)
+        second_of_day = horizon.second_of_day[start:stop]
+        changes = np.zeros(max(len(second_of_day) - 1, 0), dtype=np.bool_)
+        for value in np.unique(condition_value[condition_quantity == RULE_TIME]):
+            # every comparison operator changes where one of these does
+            changes |= np.diff(second_of_day >= value) | np.diff(second_of_day > value)
+        return np.flatnonzero(changes) + start + 1
+
+
+class ValidationController(Controller):
+    # the actual pump statuses, pump_statuses_for_validation
+    name = 'validation'
+    can_jump = True
+    can_replay = True
+
+    def __init__(self):
+        Controller.__init__(self, decide_validation)
+
+    def lower(self, pump_system, horizon):
+        validation = np.zeros((len(pump_system.levels), horizon.steps))
+        for i, level in enumerate(pump_system.levels):
+            if level.pump_statuses_for_validation is None:
+                raise ValueError('{} pumping level has no pump statuses for validation'.format(level.name))
+            validation[i, :] = level.pump_statuses_for_validation[:horizon.seconds:horizon.dt]
+        return ValidationParameters(validation, np.zeros(len(pump_system.levels), dtype=np.int64),
+                                    np.zeros(1, dtype=np.bool_))
+
+    def get_time_events(self, pump_system, horizon, start, stop):
+        # the time steps at which a pump status changes
+        changes = []
+        for level in pump_system.levels:
+            statuses = np.asarray(level.pump_statuses_for_validation[::horizon.dt][start:stop])
+            changes.append(np.flatnonzero(np.diff(statuses)) + start + 1)
+        return np.concatenate(changes)
+
+
+def get_controller(mode):
+    # the built-in controller of a simulation mode, or mode itself if it is a Controller
+    if isinstance(mode, Controller):
+        return mode
+    if mode == '1-factor':
+        return ScheduleController()
+    if mode == '2-factor':
+        return ScheduleController(upper_level_limits=True)
+    if mode == 'n-factor':
+        return NFactorController()
+    if mode == 'validation':
+        return ValidationController()
+    raise ValueError('Invalid simulation mode specified')
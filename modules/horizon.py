@@ -0,0 +1,149 @@
+import datetime
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+# Eskom ToU per hour of the day. 1 = peak, 2 = standard, 3 = off-peak
+TOU_WEEKDAY = np.array([3, 3, 3, 3, 3, 3, 2, 1, 1, 1, 2, 2, 2, 2, 2, 2, 2, 2, 1, 1, 2, 2, 3, 3], dtype=np.uint8)
+TOU_WEEKDAY_HIGH_SEASON = np.array([3, 3, 3, 3, 3, 3, 1, 1, 1, 2, 2, 2, 2, 2, 2, 2, 2, 1, 1, 2, 2, 2, 3, 3],
+                                   dtype=np.uint8)
+TOU_SATURDAY = np.array([3, 3, 3, 3, 3, 3, 3, 2, 2, 2, 2, 2, 3, 3, 3, 3, 3, 3, 2, 2, 3, 3, 3, 3], dtype=np.uint8)
+TOU_SUNDAY = np.full(24, 3, dtype=np.uint8)
+
+# rows are indexed by ISO day of the week (1 = Monday, 6 = Saturday, 7 = Sunday), as used in holidays.csv, per
+# season (0 = low, 1 = high demand season). Weekends are the same in both seasons
+TOU_DAY_TYPES = np.array([TOU_WEEKDAY, TOU_WEEKDAY, TOU_WEEKDAY, TOU_WEEKDAY, TOU_WEEKDAY, TOU_WEEKDAY,
+                          TOU_SATURDAY, TOU_SUNDAY])
+TOU_DAY_TYPES_HIGH_SEASON = np.array([TOU_WEEKDAY_HIGH_SEASON, TOU_WEEKDAY_HIGH_SEASON, TOU_WEEKDAY_HIGH_SEASON,
+                                      TOU_WEEKDAY_HIGH_SEASON, TOU_WEEKDAY_HIGH_SEASON, TOU_WEEKDAY_HIGH_SEASON,
+                                      TOU_SATURDAY, TOU_SUNDAY])
+TOU_SEASONS = np.array([TOU_DAY_TYPES, TOU_DAY_TYPES_HIGH_SEASON])
+HIGH_SEASON_MONTHS = [6, 7, 8]  # June to August
+
+BLOCKS_PER_DAY = 48  # inflow profiles are specified per half-hour
+HOLIDAYS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data processing',
+                             'holidays.csv')
+
+
+def read_holidays(path):
+    # holidays.csv has no header: date, day of the week the holiday is treated as (6 = Saturday, 7 = Sunday)
+    df = pd.read_csv(path, header=None, names=['date', 'day_type'], parse_dates=['date'])
+    return {d.date(): int(day_type) for d, day_type in zip(df['date'], df['day_type'])}
+
+
+def get_start(start_date):
+    # the first day and the second of that day the simulation starts at
+    if isinstance(start_date, datetime.datetime):
+        return start_date.date(), start_date.hour * 3600 + start_date.minute * 60 + start_date.second
+    return start_date, 0
+
+
+def get_day_types(n_days, start_date=None, holidays=None):
+    # without a start date every day is treated as a weekday
+    if start_date is None:
+        return np.ones(n_days, dtype=np.int64)
+
+    start_date, _ = get_start(start_date)
+    if isinstance(holidays, str):
+        holidays = read_holidays(holidays)
+    holidays = {} if holidays is None else holidays
+
+    day_types = np.empty(n_days, dtype=np.int64)
+    for d in range(n_days):
+        date = start_date + datetime.timedelta(days=d)
+        day_types[d] = holidays.get(date, date.isoweekday())
+
+    return day_types
+
+
+def get_seasons(n_days, start_date=None):
+    # 1 for days in the high demand season, 0 otherwise. Without a start date every day is in the low season
+    seasons = np.zeros(n_days, dtype=np.int64)
+    if start_date is None:
+        return seasons
+
+    start_date, _ = get_start(start_date)
+    for d in range(n_days):
+        seasons[d] = (start_date + datetime.timedelta(days=d)).month in HIGH_SEASON_MONTHS
+    return seasons
+
+
+def get_block_index(seconds, start_second=0):
+    # half-hour block of every second, counted from the first day. As in the original per-second inflow lookup,
+    # minute 30 still belongs to the first half. uint16 while the blocks fit (1365 days, about 3.7 years), so a year
+    # is 63 MB
+    second_of_day = np.arange(86400)
+    block_of_day = second_of_day // 3600 * 2 + ((second_of_day % 3600) // 60 > 30)
+    n_days = -(-(start_second + seconds) // 86400)
+    dtype = np.uint16 if n_days * BLOCKS_PER_DAY <= np.iinfo(np.uint16).max + 1 else np.int32
+    block_index = np.empty((n_days, 86400), dtype=dtype)
+    block_index[:] = block_of_day.astype(dtype)
+    block_index += (np.arange(n_days, dtype=dtype) * BLOCKS_PER_DAY)[:, np.newaxis]
+    return block_index.ravel()[start_second:start_second + seconds].copy()
+
+
+class Horizon:
+    # Per-second lookup tables for one simulation horizon. They only depend on time, so they are built once and
+    # reused for every run over the same horizon. They are derived from compact calendar arrays: day types and
+    # seasons per day and ToU per half-hour block.
+    # start_date (date or datetime, which also sets the time of day second 0 is at) applies weekend, holiday and
+    # seasonal ToU. holidays is a path to a holidays.csv or a dict of date: day type, HOLIDAYS_PATH by default.
+    # With a time step of dt seconds the tables hold every dt-th second only: step t is second t * dt
+    def __init__(self, seconds, start_date=None, holidays=None, dt=1):
+        if dt < 1 or int(dt) != dt:
+            raise ValueError('Invalid time step specified')
+        self.seconds = seconds
+        self.start_date = start_date
+        self.holidays = holidays
+        self.dt = int(dt)
+        self.steps = -(-seconds // self.dt)
+        self.start_second = get_start(start_date)[1]
+        self.n_days = -(-(self.start_second + seconds) // 86400)
+        if holidays is None and os.path.exists(HOLIDAYS_PATH):
+            holidays = HOLIDAYS_PATH
+        self.day_types = get_day_types(self.n_days, start_date, holidays)
+        self.seasons = get_seasons(self.n_days, start_date)
+        self.block_index = get_block_index(seconds, self.start_second)
+        if self.dt > 1:
+            self.block_index = self.block_index[::self.dt].copy()
+
+        hours = np.tile(np.repeat(np.arange(24), 2), self.n_days)
+        days = np.repeat(np.arange(self.n_days), BLOCKS_PER_DAY)
+        self.tou_blocks = TOU_SEASONS[self.seasons[days], self.day_types[days], hours]
+        self.eskom_tou = self.tou_blocks[self.block_index]
+        self._second_of_day = None
+        logging.info('Simulation horizon of {} seconds precomputed ({} s steps).'.format(seconds, self.dt))
+
+    @property
+    def second_of_day(self):
+        # second of the day of every time step, for controllers that depend on the time of day (e.g. the n-factor
+        # rules). Built on first use, 4 bytes per time step
+        if self._second_of_day is None:
+            steps = np.arange(self.steps, dtype=np.int64)
+            self._second_of_day = ((self.start_second + steps * self.dt) % 86400).astype(np.int32)
+        return self._second_of_day
+
+    def get_inflow_blocks(self, fissure_water_inflow):
+        # inflow per half-hour block, shape (pump states, blocks). Only pump dependent profiles have more than one row
+        n_blocks = self.n_days * BLOCKS_PER_DAY
+        if np.ndim(fissure_water_inflow) == 0:  # it is constant
+            return np.full((1, n_blocks), fissure_water_inflow, dtype=np.float64)
+
+        inflow = np.asarray(fissure_water_inflow, dtype=np.float64)
+        if inflow.shape[1] == 2:  # if 2 columns. Not f(pump)
+            # 24 rows per day: more than one day of profiles are used in turn, from the first day
+            profiles = inflow[:len(inflow) // 24 * 24].reshape(-1, BLOCKS_PER_DAY)
+            return profiles[np.arange(self.n_days) % len(profiles)].ravel()[np.newaxis, :]
+
+        # 3 columns. Is f(pump), with row = pumps * 24 - 1 + hour
+        hours = np.arange(24)
+        blocks = np.empty((inflow.shape[0] // 24, n_blocks))
+        for pumps in range(blocks.shape[0]):
+            blocks[pumps] = np.tile(inflow[pumps * 24 - 1 + hours, 1:3].ravel(), self.n_days)
+        return blocks
+
+    def matches(self, seconds, start_date=None, holidays=None, dt=1):
+        return seconds == self.seconds and start_date == self.start_date and holidays == self.holidays and \
+            dt == self.dt
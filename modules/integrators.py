@@ -0,0 +1,145 @@
+import logging
+import math
+
+import numpy as np
+
+from . import controllers
+
+TIME_STEPS = [300, 120, 60, 30, 10, 5, 2]  # seconds, the time steps select_time_step tries
+
+
+def get_time_events(pump_system, controller, horizon, start=0, stop=None):
+    # time steps from start up to stop at which the inflow block, ToU or a time the controller depends on (e.g. a
+    # SCADA pump status change in validation mode) changes, followed by stop
+    stop = horizon.steps if stop is None else stop
+    changes = [np.flatnonzero(np.diff(horizon.block_index[start:stop])) + start + 1,
+               controller.get_time_events(pump_system, horizon, start, stop)]
+    return np.unique(np.concatenate(changes + [[stop]]))
+
+
+def _steps_clear_of_levels(previous, current, rate, critical, tolerance):
+    # number of further steps for which the level stays on the same side of, and further than tolerance from, every
+    # critical level. 0 if it is already in a tolerance band or crossed one in the last step
+    if len(critical) == 0:
+        return math.inf
+    if np.any(np.abs(critical - current) <= tolerance) or np.any(np.abs(critical - previous) <= tolerance) or \
+            np.any((critical > previous) != (critical > current)):
+        return 0
+    if rate > 0:
+        ahead = critical[critical > current]
+        return math.inf if len(ahead) == 0 else math.ceil((ahead[0] - tolerance - current) / rate)
+    if rate < 0:
+        behind = critical[critical < current]
+        return math.inf if len(behind) == 0 else math.ceil((current - behind[-1] - tolerance) / -rate)
+    return math.inf
+
+
+def perform_event_simulation(pump_system, controller, params, horizon, tolerance=1e-6, start=1, stop=None,
+                             inflow_blocks=None):
+    # Between events every level changes linearly, so the simulation takes exact 1 s steps around events and jumps
+    # analytically over the steps in between. Events are crossings of the critical levels of the controller
+    # (schedule table thresholds, hysteresis, UL limits, n-factor bounds and rules), inflow block and ToU boundaries
+    # and the time events of the controller (SCADA status changes, n-factor rule times).
+    # Levels within tolerance of a critical level are stepped at 1 s, so decisions match the fixed-step simulation.
+    # A jump accumulates the constant per-second increment in one vectorised call, so the levels are the same floats
+    # the fixed-step simulation produces. Simulates time steps start up to stop and returns the (start, end) step of
+    # every jump.
+    levels = pump_system.levels
+    stop = horizon.steps if stop is None else stop
+    if inflow_blocks is None:
+        inflow_blocks = [horizon.get_inflow_blocks(level.fissure_water_inflow) for level in levels]
+    critical = controller.get_critical_levels(pump_system)
+    time_events = get_time_events(pump_system, controller, horizon, start, stop)
+    block_index = horizon.block_index
+
+    can_jump = controller.can_jump
+    if not can_jump:
+        logging.warning('{} controller has no critical levels, the event integrator steps every second.'.format(
+            controller.name))
+
+    jumps = []
+    states = []  # control state after each of the last steps
+    t = start
+    while t < stop:
+        pump_system._simulate_step(controller, params, t, block_index.item(t), inflow_blocks,
+                                   pump_system.instrumentation)
+        states = states[-2:] + [controller.get_state(params)]
+
+        # Only jump from a stationary state: nothing switched in the last two steps and the control state repeats
+        # with a period of at most 2 (the n-factor last change toggles between bounds while pumps are at maximum).
+        # Step t + 1 then repeats step t - 1, t + 2 repeats t, and so on
+        stationary = can_jump and len(states) == 3 and states[2] == states[0] and \
+            block_index.item(t) == block_index.item(t - 2) and all(
+                [level.get_pump_status_history(t) == level.get_pump_status_history(t - 1) ==
+                 level.get_pump_status_history(t - 2) for level in levels])
+        if not stationary:
+            t += 1
+            continue
+
+        # the steps after t up to the next time event stay in the same inflow block and ToU slot
+        steps = time_events[np.searchsorted(time_events, t, side='right')] - t - 1
+        rates = []
+        for i, (level, inflow) in enumerate(zip(levels, inflow_blocks)):
+            pumps = level.get_pump_status_history(t)
+            outflow = pumps * level.pump_flow
+            additional_in_flow = 0
+            for j in pump_system.feed_lists[i]:
+                additional_in_flow += levels[j].get_last_outflow()
+            fissure_water_inflow = inflow.item(0 if len(inflow) == 1 else int(pumps), block_index.item(t))
+            rate = 100 / level.capacity * horizon.dt * (fissure_water_inflow + additional_in_flow - outflow)
+            rates.append(rate)
+            steps = min(steps, _steps_clear_of_levels(level.get_level_history(t - 2), level.get_level_history(t),
+                                                      rate, critical[i], tolerance))
+
+        if steps > 0:
+            end = t + int(steps)
+            for level, rate in zip(levels, rates):
+                increments = np.full(end - t + 1, rate)
+                increments[0] = level.get_level_history(t)
+                level.fill_state(t + 1, end + 1, np.add.accumulate(increments)[1:], level.get_pump_status_history(t))
+            controller.set_state(params, states[2] if steps % 2 == 0 else states[1])
+            jumps.append((t, end))
+            states = []
+            t = end
+        t += 1
+
+    logging.info('{} event simulation took {} jumps over {} time steps.'.format(pump_system.name, len(jumps),
+                                                                                stop - start))
+    return jumps
+
+
+def get_level_error(pump_system, reference, seconds):
+    # largest level difference (in %) of the latest simulation from reference, a table with a '<level> Level' column
+    # per second (e.g. a committed output), over the time steps both cover
+    error = 0.0
+    for level in pump_system.levels:
+        expected = np.asarray(reference[level.name + ' Level'])[:seconds:pump_system.dt]
+        n = min(len(expected), level.history_length)
+        error = max(error, np.abs(level.get_level_history()[:n] - expected[:n]).max())
+    return error
+
+
+def select_time_step(pump_system, mode, tolerance, seconds=86400, reference=None, time_steps=None,
+                     **simulation_kwargs):
+    # The largest of time_steps (TIME_STEPS by default) for which the levels stay within tolerance (in %) of the 1 s
+    # levels over seconds: those of reference (see get_level_error) or of a 1 s simulation. Every time step is tried
+    # with perform_simulation(mode, seconds, dt=..., **simulation_kwargs), largest first, each run starting from the
+    # initial state. Returns the time step (1 if none is within tolerance) and the level error of every time step
+    # tried
+    controller = controllers.get_controller(mode)
+    if reference is None:
+        pump_system.perform_simulation(controller, seconds, dt=1, **simulation_kwargs)
+        reference = {level.name + ' Level': level.get_level_history().copy() for level in pump_system.levels}
+
+    errors = {}
+    for dt in sorted(TIME_STEPS if time_steps is None else time_steps, reverse=True):
+        pump_system.perform_simulation(controller, seconds, dt=dt, **simulation_kwargs)
+        errors[dt] = get_level_error(pump_system, reference, seconds)
+        if errors[dt] <= tolerance:
+            logging.info('{} time step of {} s selected, the levels are within {:.3g} % of 1 s steps.'.format(
+                pump_system.name, dt, errors[dt]))
+            return dt, errors
+
+    logging.warning('{} levels are not within {} % of 1 s steps with any larger time step.'.format(pump_system.name,
+                                                                                                     tolerance))
+    return 1, errors
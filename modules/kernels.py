@@ -0,0 +1,121 @@
+import logging
+
+import numpy as np
+
+from . import controllers
+
+try:
+    import numba
+except ImportError:  # numba is optional, the kernels then run as plain Python on the same flat arrays
+    numba = None
+
+
+def _jit(func):
+    if numba is None:
+        return func
+    return numba.njit(cache=True)(func)
+
+
+def can_simulate(controller):
+    # the compiled kernel can only call compiled decide functions
+    return numba is None or controllers.is_compiled(controller.decide)
+
+
+def lower_pump_system(pump_system, horizon):
+    # flatten the pumping levels into arrays, indexed by level position in the pump system. The control law is
+    # lowered separately, by the controller
+    levels = pump_system.levels
+    n_levels = len(levels)
+    inflow_blocks = [horizon.get_inflow_blocks(level.fissure_water_inflow) for level in levels]
+
+    capacity = np.empty(n_levels)
+    pump_flow = np.empty(n_levels)
+    last_outflow = np.zeros(n_levels)
+    # inflow per half-hour block. Only pump dependent profiles use more than the first row
+    inflow_table = np.zeros((n_levels, max([len(b) for b in inflow_blocks]), inflow_blocks[0].shape[1]))
+    inflow_pump_dependent = np.zeros(n_levels, dtype=np.bool_)
+
+    for i, level in enumerate(levels):
+        capacity[i] = level.capacity
+        pump_flow[i] = level.pump_flow
+        last_outflow[i] = level.get_last_outflow()
+        inflow_table[i, :len(inflow_blocks[i])] = inflow_blocks[i]
+        inflow_pump_dependent[i] = len(inflow_blocks[i]) > 1
+
+    # feed topology in CSR form, see PumpSystem.build_topology
+    return {'capacity': capacity, 'pump_flow': pump_flow, 'last_outflow': last_outflow,
+            'inflow_pump_dependent': inflow_pump_dependent, 'inflow_table': inflow_table,
+            'block_index': horizon.block_index, 'feed_start': pump_system.feed_start,
+            'feed_index': pump_system.feed_index, 'dt': float(horizon.dt)}
+
+
+@_jit
+def _simulate(decide, params, start, stop, offset, levels, statuses, tou, capacity, pump_flow, last_outflow,
+              inflow_pump_dependent, inflow_table, block_index, feed_start, feed_index, dt):
+    # levels and statuses hold the time steps (of dt seconds) from offset onwards
+    n_levels = levels.shape[0]
+    pumps_required = np.empty(n_levels)
+
+    for t in range(start, stop):
+        block = block_index[t]
+        decide(t, tou[t], tou[t - 1], levels[:, t - 1 - offset], statuses[:, t - 1 - offset], pumps_required, params)
+
+        for l in range(n_levels):
+            pumps = pumps_required[l]
+            outflow = pumps * pump_flow[l]
+            last_outflow[l] = outflow
+
+            additional_in_flow = 0.0
+            for k in range(feed_start[l], feed_start[l + 1]):
+                additional_in_flow += last_outflow[feed_index[k]]
+
+            if inflow_pump_dependent[l]:
+                inflow = inflow_table[l, int(pumps), block]
+            else:
+                inflow = inflow_table[l, 0, block]
+
+            levels[l, t - offset] = levels[l, t - 1 - offset] + 100 / capacity[l] * dt * (
+                inflow + additional_in_flow - outflow)
+            statuses[l, t - offset] = pumps
+
+
+def _get_buffers(pump_system):
+    # the history buffers of the levels as rows of one 2D array per quantity. After a first run they already are,
+    # so only the first call of a simulation copies them
+    levels = pump_system.levels[0].level_history.base
+    statuses = pump_system.levels[0].pump_status_history.base
+    if levels is not None and statuses is not None and levels.ndim == 2 and statuses.ndim == 2 and \
+            levels.shape[0] == len(pump_system.levels) and all(
+                [level.level_history.ctypes.data == levels[i].ctypes.data and
+                 level.pump_status_history.ctypes.data == statuses[i].ctypes.data and
+                 len(level.level_history) == levels.shape[1] for i, level in enumerate(pump_system.levels)]):
+        return levels, statuses
+
+    window = len(pump_system.levels[0].level_history)
+    levels = np.empty((len(pump_system.levels), window), dtype=np.float64)
+    statuses = np.empty((len(pump_system.levels), window), dtype=np.int8)
+    for i, level in enumerate(pump_system.levels):
+        levels[i, :level.history_length] = level.get_level_history()
+        statuses[i, :level.history_length] = level.get_pump_status_history()
+        level.level_history = levels[i]
+        level.pump_status_history = statuses[i]
+    return levels, statuses
+
+
+def simulate(pump_system, controller, params, arrays, start, stop):
+    # run time steps start up to stop on the flat kernel, with arrays from lower_pump_system and params from
+    # controller.lower. The history buffers of the levels become rows of one 2D array, which the kernel writes into
+    # directly
+    if numba is None:
+        logging.warning('numba is not installed, the jit engine runs as plain Python.')
+
+    levels, statuses = _get_buffers(pump_system)
+    offset = pump_system.levels[0].history_offset
+    for i, level in enumerate(pump_system.levels):  # the state may have been changed since arrays were lowered
+        arrays['last_outflow'][i] = level.get_last_outflow()
+
+    _simulate(controller.decide, params, start, stop, offset, levels, statuses, pump_system.eskom_tou, **arrays)
+
+    for i, level in enumerate(pump_system.levels):
+        level.history_length = stop - offset
+        level.set_last_outflow(arrays['last_outflow'][i])
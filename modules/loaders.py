@@ -0,0 +1,107 @@
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIRECTORY = '.input_cache'  # created next to the files that are cached
+
+
+def get_file_hash(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def get_cache_path(path, cache_directory=None):
+    directory, file_name = os.path.split(os.path.abspath(path))
+    return os.path.join(os.path.join(directory, CACHE_DIRECTORY) if cache_directory is None else cache_directory,
+                        file_name)
+
+
+class CachedTable:
+    # A CSV file (e.g. the 1 s SCADA pivot or validation data) converted once into one .npy file per column. Later
+    # loads only read a small manifest, and columns are memory mapped read-only when they are first used.
+    # The cache is keyed by the modification time and size of the file, and by its hash when those changed
+    def __init__(self, path, cache_directory=None):
+        self.path = path
+        self.cache_path = get_cache_path(path, cache_directory)
+        self.manifest = self._load_manifest()
+        self.columns = [column['name'] for column in self.manifest['columns']]
+        self.n_rows = self.manifest['rows']
+        self._arrays = {}
+
+    def _load_manifest(self):
+        stat = os.stat(self.path)
+        manifest_path = os.path.join(self.cache_path, 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest['mtime'] == stat.st_mtime and manifest['size'] == stat.st_size:
+                return manifest
+
+            # touched, but possibly not changed
+            if manifest['sha256'] == get_file_hash(self.path):
+                manifest['mtime'] = stat.st_mtime
+                manifest['size'] = stat.st_size
+                self._write_manifest(manifest)
+                return manifest
+
+        return self._build_cache(stat)
+
+    def _build_cache(self, stat):
+        df = pd.read_csv(self.path)
+        os.makedirs(self.cache_path, exist_ok=True)
+        columns = []
+        for i, name in enumerate(df.columns):
+            values = df[name].values
+            if values.dtype.kind not in 'biuf':  # text (e.g. date and time) columns are stored as fixed size strings
+                values = values.astype(np.str_)
+            file_name = '{}.npy'.format(i)
+            np.save(os.path.join(self.cache_path, file_name), values)
+            columns.append({'name': name, 'file': file_name})
+
+        # the manifest is written last, so an interrupted conversion is redone on the next load
+        manifest = {'mtime': stat.st_mtime, 'size': stat.st_size, 'sha256': get_file_hash(self.path),
+                    'rows': len(df), 'columns': columns}
+        self._write_manifest(manifest)
+        logging.info('{} cached in {}.'.format(self.path, self.cache_path))
+        return manifest
+
+    def _write_manifest(self, manifest):
+        with open(os.path.join(self.cache_path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+
+    def __len__(self):
+        return self.n_rows
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        # read-only view of the column, without reading it into memory
+        if name not in self._arrays:
+            if name not in self.columns:
+                raise KeyError('{} has no {} column'.format(self.path, name))
+            file_name = self.manifest['columns'][self.columns.index(name)]['file']
+            self._arrays[name] = np.load(os.path.join(self.cache_path, file_name), mmap_mode='r')
+        return self._arrays[name]
+
+    def get_initial_value(self, name):
+        return self[name][0]
+
+    def get_inflow_profile(self, name):
+        # half-hourly inflow column as the (24, 2) array PumpingLevel takes, (24 x days, 2) for per-day profiles
+        return np.reshape(self[name], (-1, 2))
+
+    def to_frame(self, columns=None):
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame({name: self[name] for name in columns})
+
+
+def read_table(path, cache_directory=None):
+    return CachedTable(path, cache_directory)
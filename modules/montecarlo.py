@@ -0,0 +1,213 @@
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from . import batch, horizon, kernels
+
+LEVEL_BINS = np.linspace(-50, 150, 1001)  # edges of the level histograms, 0.2 % wide
+
+
+class ParametricInflow:
+    # Lognormal inflow factors with a mean of 1 and a coefficient of variation of cv (one for all levels or one per
+    # level), multiplying the inflow profiles per half-hour block. correlation is that of consecutive blocks of a
+    # level (AR(1) on the underlying normal), 0 for independent blocks
+    def __init__(self, cv=0.2, correlation=0.0):
+        if np.any(np.asarray(cv) < 0) or not -1 < correlation < 1:
+            raise ValueError('Invalid inflow variation specified')
+        self.cv = cv
+        self.correlation = correlation
+
+    def sample(self, pump_system, horizon, n, rng):
+        n_levels = len(pump_system.levels)
+        n_blocks = len(horizon.tou_blocks)
+        sigma = np.sqrt(np.log1p(np.broadcast_to(np.asarray(self.cv, dtype=np.float64), (n_levels,)) ** 2))
+        z = rng.standard_normal((n, n_levels, n_blocks))
+        if self.correlation != 0:
+            z[:, :, 1:] *= np.sqrt(1 - self.correlation ** 2)
+            for k in range(1, n_blocks):
+                z[:, :, k] += self.correlation * z[:, :, k - 1]
+        sigma = sigma[:, np.newaxis]
+        return np.exp(sigma * z - sigma ** 2 / 2)
+
+
+def get_inflow_factors(pump_system, observations):
+    # Inflow per half-hour block of measured data (a table with '<level> Level' and '<level> Status' columns per
+    # second from midnight, e.g. the SCADA validation data), estimated from the mass balance and divided by the inflow
+    # profiles. Shape (levels, blocks). Levels without data, and blocks without profile inflow, have a factor of 1
+    n_seconds = len(observations)
+    obs_horizon = horizon.Horizon(n_seconds)
+    arrays = kernels.lower_pump_system(pump_system, obs_horizon)
+    names = [level.name for level in pump_system.levels]
+    measured = [name + ' Level' in observations and name + ' Status' in observations for name in names]
+
+    statuses = np.zeros((len(names), n_seconds))
+    for l, name in enumerate(names):
+        if measured[l]:
+            statuses[l] = np.nan_to_num(np.asarray(observations[name + ' Status'], dtype=np.float64))
+    outflow = statuses * arrays['pump_flow'][:, np.newaxis]
+
+    # the engine's mass balance, solved for the inflow of seconds 1 onwards
+    inflow = np.zeros((len(names), n_seconds - 1))
+    for l, name in enumerate(names):
+        if not measured[l]:
+            continue
+        levels = np.asarray(observations[name + ' Level'], dtype=np.float64)
+        inflow[l] = np.diff(levels) * arrays['capacity'][l] / 100 + outflow[l, 1:]
+        for k in range(arrays['feed_start'][l], arrays['feed_start'][l + 1]):
+            j = arrays['feed_index'][k]
+            inflow[l] -= outflow[j, 1:] if j < l else outflow[j, :-1]
+
+    # the profile inflow of every second, at the measured pump statuses for pump dependent profiles
+    blocks = obs_horizon.block_index[1:].astype(np.int64)
+    n_blocks = obs_horizon.n_days * horizon.BLOCKS_PER_DAY
+    counts = np.bincount(blocks, minlength=n_blocks)
+    factors = np.ones((len(names), n_blocks))
+    for l in range(len(names)):
+        if not measured[l]:
+            continue
+        rows = statuses[l, 1:].astype(np.int64) if arrays['inflow_pump_dependent'][l] else 0
+        rows = np.clip(rows, 0, arrays['inflow_table'].shape[1] - 1)
+        expected = np.bincount(blocks, arrays['inflow_table'][l, rows, blocks], n_blocks)
+        actual = np.bincount(blocks, inflow[l], n_blocks)
+        has_profile = (counts > 0) & (expected > 0)
+        factors[l, has_profile] = np.maximum(actual[has_profile] / expected[has_profile], 0)
+    return factors[:, counts > 0]
+
+
+class BootstrapInflow:
+    # Moving block bootstrap of the inflow factors measured in observations (see get_inflow_factors): realisations
+    # are runs of block_length consecutive half-hour blocks drawn at random (wrapping around the measured blocks).
+    # All levels draw the same blocks, which keeps the correlation between them
+    def __init__(self, pump_system, observations, block_length=4):
+        if block_length < 1:
+            raise ValueError('Invalid bootstrap block length specified')
+        self.factors = get_inflow_factors(pump_system, observations)
+        self.block_length = block_length
+        logging.info('{} inflow factors estimated from {} half-hour blocks of data.'.format(
+            pump_system.name, self.factors.shape[1]))
+
+    def sample(self, pump_system, horizon, n, rng):
+        n_blocks = len(horizon.tou_blocks)
+        n_measured = self.factors.shape[1]
+        n_runs = -(-n_blocks // self.block_length)
+        starts = rng.integers(0, n_measured, (n, n_runs))
+        index = (starts[:, :, np.newaxis] + np.arange(self.block_length)).reshape(n, -1)[:, :n_blocks] % n_measured
+        return self.factors[:, index].transpose(1, 0, 2)
+
+
+class StreamingStatistics:
+    # Statistics of the levels per time block over any number of realisations, updated a batch at a time without
+    # keeping the trajectories: count, mean and standard deviation of the level at the end of each block, a
+    # histogram of it for quantiles, and the number of realisations that overflowed (above limits[1]) or ran dry
+    # (below limits[0]) during the block, and at any time
+    def __init__(self, level_names, block_ends, limits=(0, 100), bins=LEVEL_BINS):
+        self.level_names = list(level_names)
+        self.block_ends = np.asarray(block_ends)  # last second of every block
+        self.limits = limits
+        self.bins = np.asarray(bins, dtype=np.float64)
+        n_levels, n_blocks = len(self.level_names), len(self.block_ends)
+        self.count = np.zeros(n_blocks, dtype=np.int64)
+        self.sum = np.zeros((n_levels, n_blocks))
+        self.sum_of_squares = np.zeros((n_levels, n_blocks))
+        self.histogram = np.zeros((n_levels, n_blocks, len(self.bins) + 1), dtype=np.int32)
+        self.overflow = np.zeros((n_levels, n_blocks), dtype=np.int64)
+        self.dry = np.zeros((n_levels, n_blocks), dtype=np.int64)
+        self.n_realisations = 0
+        self.overflow_any = np.zeros(n_levels, dtype=np.int64)
+        self.dry_any = np.zeros(n_levels, dtype=np.int64)
+
+    def add(self, block, levels, window_min, window_max):
+        # levels (realisations x levels) at the end of the block, window_min and window_max their extremes during it
+        n_levels = len(self.level_names)
+        self.count[block] += len(levels)
+        self.sum[:, block] += levels.sum(axis=0)
+        self.sum_of_squares[:, block] += (levels ** 2).sum(axis=0)
+        bins = np.searchsorted(self.bins, levels, side='right')
+        self.histogram[:, block] += np.bincount((np.arange(n_levels) * (len(self.bins) + 1) + bins).ravel(),
+                                                minlength=n_levels * (len(self.bins) + 1)).reshape(n_levels, -1)
+        self.overflow[:, block] += (window_max > self.limits[1]).sum(axis=0)
+        self.dry[:, block] += (window_min < self.limits[0]).sum(axis=0)
+
+    def add_horizon(self, min_level, max_level):
+        # level extremes of every realisation over the whole horizon
+        self.n_realisations += len(min_level)
+        self.overflow_any += (max_level > self.limits[1]).sum(axis=0)
+        self.dry_any += (min_level < self.limits[0]).sum(axis=0)
+
+    def merge(self, other):
+        # add the statistics of other realisations, e.g. from another process
+        if other.level_names != self.level_names or not np.array_equal(other.block_ends, self.block_ends) or \
+                not np.array_equal(other.bins, self.bins) or other.limits != self.limits:
+            raise ValueError('Invalid statistics to merge')
+        for name in ['count', 'sum', 'sum_of_squares', 'histogram', 'overflow', 'dry', 'overflow_any', 'dry_any']:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.n_realisations += other.n_realisations
+        return self
+
+    def get_quantiles(self, q):
+        # levels x blocks, interpolated within the histogram bins. Levels outside the bins are clamped to their edges
+        cumulative = np.cumsum(self.histogram, axis=2)
+        target = q * np.maximum(self.count, 1)[np.newaxis, :, np.newaxis]
+        index = np.minimum((cumulative < target).sum(axis=2), len(self.bins))
+        index = index[:, :, np.newaxis]
+        edges = np.concatenate([self.bins[:1], self.bins, self.bins[-1:]])
+        lower, upper = edges[index], edges[index + 1]
+        below = np.take_along_axis(cumulative, index, axis=2) - np.take_along_axis(self.histogram, index, axis=2)
+        in_bin = np.maximum(np.take_along_axis(self.histogram, index, axis=2), 1)
+        fraction = np.clip((target - below) / in_bin, 0, 1)
+        return (lower + fraction * (upper - lower))[:, :, 0]
+
+    def summary(self, quantiles=(0.05, 0.5, 0.95)):
+        # one row per level and block
+        count = np.maximum(self.count, 1)
+        mean = self.sum / count
+        std = np.sqrt(np.maximum(self.sum_of_squares / count - mean ** 2, 0))
+        n_levels, n_blocks = mean.shape
+        df = pd.DataFrame({'Level': np.repeat(self.level_names, n_blocks), 'Block': np.tile(np.arange(n_blocks),
+                                                                                             n_levels),
+                           'Second': np.tile(self.block_ends, n_levels), 'Count': np.tile(self.count, n_levels),
+                           'Mean': mean.ravel(), 'Std': std.ravel()})
+        for q in quantiles:
+            df['Q{:g}'.format(q * 100)] = self.get_quantiles(q).ravel()
+        df['P(overflow)'] = (self.overflow / count).ravel()
+        df['P(dry)'] = (self.dry / count).ravel()
+        return df
+
+    def horizon_summary(self):
+        # per level, the probability of overflowing or running dry at any time
+        n = max(self.n_realisations, 1)
+        return pd.DataFrame({'P(overflow)': self.overflow_any / n, 'P(dry)': self.dry_any / n},
+                            index=pd.Index(self.level_names, name='Level'))
+
+
+def run_monte_carlo(pump_system, mode, sampler, n_realisations, seconds=86400, batch_size=256, observe_every=1800,
+                    limits=(0, 100), seed=None, start_date=None, holidays=None, statistics=None):
+    # Simulate n_realisations inflow realisations drawn by sampler (ParametricInflow or BootstrapInflow), batch_size
+    # at a time in a BatchPumpSystem, and return their StreamingStatistics over blocks of observe_every seconds.
+    # Only the modes of the batch simulations are supported. Pass statistics to add to earlier runs
+    logging.info('{} Monte-Carlo simulation of {} realisations started in {} mode.'.format(pump_system.name,
+                                                                                           n_realisations, mode))
+    start_time = time.time()
+    rng = np.random.default_rng(seed)
+    sim_horizon = pump_system.get_horizon(seconds, start_date, holidays)
+    block_ends = np.minimum(np.arange(1, -(-seconds // observe_every) + 1) * observe_every, seconds) - 1
+    if statistics is None:
+        statistics = StreamingStatistics([level.name for level in pump_system.levels], block_ends, limits)
+
+    def observer(t, scenarios):
+        statistics.add(t // observe_every, scenarios.levels, scenarios.window_min_level, scenarios.window_max_level)
+
+    for first in range(0, n_realisations, batch_size):
+        n = min(batch_size, n_realisations - first)
+        scenarios = batch.BatchPumpSystem(pump_system, n, inflow_scale=sampler.sample(pump_system, sim_horizon, n,
+                                                                                     rng))
+        scenarios.perform_simulation(mode, seconds, start_date, holidays, limits=limits, observer=observer,
+                                     observe_every=observe_every)
+        statistics.add(len(block_ends) - 1, scenarios.levels, scenarios.window_min_level,
+                       scenarios.window_max_level)
+        statistics.add_horizon(scenarios.min_level, scenarios.max_level)
+
+    logging.info('{} Monte-Carlo simulation completed in {:.1f} s.'.format(pump_system.name, time.time() - start_time))
+    return statistics
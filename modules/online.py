@@ -0,0 +1,125 @@
+import copy
+import logging
+
+from . import accounting, controllers, kernels
+
+DEFAULT_HORIZON = 86400  # the ToU and inflow tables are extended by at least a day at a time
+
+
+class OnlineSimulation:
+    # Runs a pump system alongside the plant. The state is kept between calls: step and advance_to only simulate the
+    # seconds advanced, observe re-anchors the current state on measurements and forecast simulates ahead on a copy.
+    # Only the latest history_seconds are kept in the history buffers of the levels, the results (see
+    # accounting.SimulationResults) cover everything simulated
+    def __init__(self, pump_system, mode, engine='python', integrator='fixed', tolerance=1e-6, start_date=None,
+                 holidays=None, history_seconds=3600, tariff=None):
+        controller = controllers.get_controller(mode)
+        if engine not in ['python', 'jit']:
+            raise ValueError('Invalid simulation engine specified')
+        if integrator not in ['fixed', 'event']:
+            raise ValueError('Invalid simulation integrator specified')
+        if history_seconds < 1:
+            raise ValueError('Invalid history length specified')
+        pump_system.check_topology()
+
+        self.pump_system = pump_system
+        self.controller = controller
+        self.mode = controller.name
+        self.engine = engine
+        self.integrator = integrator
+        self.tolerance = tolerance
+        self.start_date = start_date
+        self.holidays = holidays
+        self.time = 0  # latest simulated second
+
+        pump_system.reset_pumpsystem_state()
+        for level in pump_system.levels:
+            level.allocate_history(history_seconds + 1)
+        self.horizon = None
+        self._extend_horizon(DEFAULT_HORIZON - 1)
+        pump_system.results = accounting.SimulationResults(pump_system, tariff)
+        pump_system.results.add(pump_system, 0, 1)
+        logging.info('{} online simulation started in {} mode.'.format(pump_system.name, self.mode))
+
+    def _extend_horizon(self, t):
+        # make sure the ToU and inflow tables cover second t, doubling them if not
+        if self.horizon is not None and t < self.horizon.seconds:
+            return
+        seconds = DEFAULT_HORIZON if self.horizon is None else self.horizon.seconds
+        while seconds <= t:
+            seconds *= 2
+        self.horizon = self.pump_system.get_horizon(seconds, self.start_date, self.holidays)
+        self.pump_system.eskom_tou = self.horizon.eskom_tou
+        self.pump_system.dt = self.horizon.dt  # online simulations step every second
+        self.inflow_blocks = [self.horizon.get_inflow_blocks(level.fissure_water_inflow)
+                              for level in self.pump_system.levels]
+        self.params = self.controller.lower(self.pump_system, self.horizon)
+        self.arrays = self._lower_pump_system(self.controller)
+
+    def _lower_pump_system(self, controller):
+        if self.integrator != 'fixed' or self.engine != 'jit':
+            return None
+        if not kernels.can_simulate(controller):
+            logging.warning('{} controller is not compiled, using the python engine.'.format(controller.name))
+            return None
+        return kernels.lower_pump_system(self.pump_system, self.horizon)
+
+    def observe(self, observations):
+        # Re-anchor the current state on measurements, given as {'<level name> Level': level, '<level name> Status':
+        # pumps}, the column names of the validation data. Levels that are not observed keep their simulated state
+        for name, value in observations.items():
+            level_name, _, quantity = name.rpartition(' ')
+            level = self.pump_system.get_level_from_name(level_name)
+            if level is None or quantity not in ['Level', 'Status']:
+                raise ValueError('Invalid observation {}'.format(name))
+
+            if quantity == 'Level':
+                level.set_state(self.time, value, level.get_pump_status_history(self.time))
+            else:
+                level.set_state(self.time, level.get_level_history(self.time), value)
+                level.set_last_outflow(value * level.pump_flow)
+
+    def advance_to(self, t):
+        if t < self.time:
+            raise ValueError('Invalid time {}, the online simulation is already at second {}'.format(t, self.time))
+        self._extend_horizon(t)
+
+        levels = self.pump_system.levels
+        while self.time < t:
+            if levels[0].history_length == len(levels[0].level_history):  # the history buffers are full
+                for level in levels:
+                    level.rebase_history()
+            stop = min(t + 1, levels[0].history_offset + len(levels[0].level_history))
+            self.pump_system._run_engine(self.controller, self.params, self.horizon, self.time + 1, stop,
+                                         self.integrator, self.tolerance, self.arrays, self.inflow_blocks)
+            self.pump_system.results.add(self.pump_system, self.time + 1, stop)
+            self.time = stop - 1
+
+    def step(self, n_seconds=1, observations=None):
+        # observations (see observe) apply to the current second, before stepping
+        if observations is not None:
+            self.observe(observations)
+        self.advance_to(self.time + n_seconds)
+
+    def forecast(self, n_seconds, mode=None):
+        # Simulate n_seconds ahead of the current state, in this or another mode (or controller), leaving this
+        # simulation as is.
+        # Returns a copy of the pump system whose histories hold the forecast, starting at the current second. Its
+        # results only cover the forecast seconds
+        controller = self.controller if mode is None else controllers.get_controller(mode)
+        self._extend_horizon(self.time + n_seconds)
+
+        system = copy.copy(self.pump_system)
+        system.levels = [copy.copy(level) for level in self.pump_system.levels]
+        for level in system.levels:
+            level.allocate_history(n_seconds + 1, keep_latest=True)
+
+        if controller is self.controller:  # the control state is loaded from the levels of the copy
+            params, arrays = self.params, self.arrays
+        else:
+            params, arrays = controller.lower(system, self.horizon), self._lower_pump_system(controller)
+        system.results = accounting.SimulationResults(system, self.pump_system.results.tariff)
+        system._run_engine(controller, params, self.horizon, self.time + 1, self.time + n_seconds + 1,
+                           self.integrator, self.tolerance, arrays, self.inflow_blocks)
+        system.results.add(system, self.time + 1, self.time + n_seconds + 1)
+        return system
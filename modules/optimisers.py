@@ -0,0 +1,168 @@
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from . import sweeps
+from .batch import BatchPumpSystem
+
+# cost per kWh in the peak, standard and off-peak ToU slots. By default only peak energy is minimised
+PEAK_TARIFF = (1.0, 0.0, 0.0)
+VIOLATION_PENALTY = 1e4  # cost per second that any level is outside its limits
+N_FACTOR_PARAMETERS = ['n_mode_min_level', 'n_mode_max_level', 'n_mode_control_range']
+
+
+def get_cost(energy, violations, tariff=PEAK_TARIFF, penalty=VIOLATION_PENALTY):
+    # energy in kWh per ToU slot (columns peak, standard, off-peak), violations in seconds
+    return np.asarray(energy) @ np.asarray(tariff, dtype=np.float64) + penalty * np.asarray(violations)
+
+
+def cross_entropy_search(evaluate, mean, std, lower, upper, n_candidates=32, n_generations=20, elite_fraction=0.25,
+                         min_std=0.5, seed=None):
+    # Elitist cross-entropy method. Every generation samples candidates from a normal distribution (clipped to lower
+    # and upper) and refits it to the best candidates found so far, until it has collapsed or n_generations ran.
+    # evaluate(candidates, cutoff) returns the cost of every candidate. Candidates costing more than cutoff cannot
+    # become elites, so evaluate may stop simulating them early and return inf.
+    # Returns the best candidate, its cost and the convergence trace
+    rng = np.random.default_rng(seed)
+    n_elites = max(2, int(round(n_candidates * elite_fraction)))
+    mean = np.asarray(mean, dtype=np.float64)
+    std = np.broadcast_to(np.asarray(std, dtype=np.float64), mean.shape)
+
+    start_time = time.time()
+    elites = mean[np.newaxis, :]
+    elite_costs = evaluate(elites, np.inf)
+    trace = [{'Generation': 0, 'Best cost': elite_costs[0], 'Elite mean cost': elite_costs[0], 'Evaluated': 1,
+              'Terminated early': 0, 'Time [s]': time.time() - start_time}]
+
+    for generation in range(1, n_generations + 1):
+        candidates = np.clip(rng.normal(mean, std, (n_candidates, len(mean))), lower, upper)
+        cutoff = elite_costs[-1] if len(elite_costs) == n_elites else np.inf
+        costs = evaluate(candidates, cutoff)
+
+        pool = np.concatenate([elites, candidates])
+        pool_costs = np.concatenate([elite_costs, costs])
+        order = np.argsort(pool_costs, kind='stable')[:n_elites]
+        order = order[np.isfinite(pool_costs[order])]
+        elites = pool[order]
+        elite_costs = pool_costs[order]
+        mean = elites.mean(axis=0)
+        std = np.maximum(elites.std(axis=0), min_std)
+
+        trace.append({'Generation': generation, 'Best cost': elite_costs[0], 'Elite mean cost': elite_costs.mean(),
+                      'Evaluated': len(candidates), 'Terminated early': int(np.isinf(costs).sum()),
+                      'Time [s]': time.time() - start_time})
+        logging.info('Generation {}: best cost {:.1f}.'.format(generation, elite_costs[0]))
+        if len(elites) == n_elites and np.all(elites.std(axis=0) <= min_std):
+            break
+
+    return elites[0], elite_costs[0], pd.DataFrame(trace)
+
+
+def _get_levels_to_optimise(pump_system, level_names):
+    if level_names is None:
+        return [level for level in pump_system.levels if level.max_pumps >= 1]
+    levels = [pump_system.get_level_from_name(name) for name in level_names]
+    if None in levels:
+        raise ValueError('Invalid level to optimise, no such pumping level')
+    return levels
+
+
+def optimise_schedules(pump_system, mode='1-factor', level_names=None, seconds=86400, tariff=PEAK_TARIFF,
+                       penalty=VIOLATION_PENALTY, limits=(0, 100), initial_std=10.0, resolution=1.0,
+                       terminate_early=True, observe_every=1800, start_date=None, holidays=None, **search_kwargs):
+    # Search the thresholds of the pump schedule tables (the rows in use, for every ToU slot) of level_names (default
+    # all levels with pumps) that minimise the ToU cost, penalising seconds outside limits. Candidates are simulated
+    # together on a BatchPumpSystem, which drops those that already cost more than the elites every observe_every
+    # seconds. Thresholds are rounded to resolution and kept increasing with the number of pumps. Thresholds at or
+    # above limits[1] (e.g. 110 for pumps that never start in that ToU slot) are kept as they are.
+    # Returns the best pump_schedule_table per level name and the convergence trace (see cross_entropy_search)
+    if mode not in ['1-factor', '2-factor']:
+        raise ValueError('Invalid optimisation mode specified')
+    levels = _get_levels_to_optimise(pump_system, level_names)
+    level_index = [pump_system.level_index[level.name] for level in levels]
+    max_rows = max([len(level.pump_schedule_table) for level in pump_system.levels])
+    base = np.zeros((len(pump_system.levels), max_rows, 3))
+    for i, level in enumerate(pump_system.levels):
+        table = np.asarray(level.pump_schedule_table, dtype=np.float64)
+        base[i, :table.shape[0], :table.shape[1]] = table
+    searched = [base[i, :level.max_pumps] < limits[1] for i, level in zip(level_index, levels)]
+
+    def get_tables(candidates):
+        tables = np.broadcast_to(base, (len(candidates),) + base.shape).copy()
+        candidates = np.round(candidates / resolution) * resolution
+        offset = 0
+        for i, level, mask in zip(level_index, levels, searched):
+            size = np.count_nonzero(mask)
+            thresholds = tables[:, i, :level.max_pumps]
+            thresholds[:, mask] = candidates[:, offset:offset + size]
+            tables[:, i, :level.max_pumps] = np.sort(thresholds, axis=1)
+            offset += size
+        return tables
+
+    def evaluate(candidates, cutoff):
+        def keep_candidates(t, batch):
+            # costs only grow during the day
+            return get_cost(batch.energy, batch.violations, tariff, penalty) <= cutoff
+
+        observer = keep_candidates if terminate_early and np.isfinite(cutoff) else None
+        batch = BatchPumpSystem(pump_system, len(candidates), schedule_tables=get_tables(candidates))
+        batch.perform_simulation(mode, seconds, start_date, holidays, limits=limits, observer=observer,
+                                 observe_every=observe_every)
+        costs = get_cost(batch.energy, batch.violations, tariff, penalty)
+        costs[batch.terminated >= 0] = np.inf
+        return costs
+
+    mean = np.concatenate([base[i, :level.max_pumps][mask] for i, level, mask in zip(level_index, levels, searched)])
+    if len(mean) == 0:
+        raise ValueError('Invalid schedule optimisation, no thresholds below the upper limit')
+    logging.info('{} {} schedule optimisation of {} thresholds started.'.format(pump_system.name, mode, len(mean)))
+    best, cost, trace = cross_entropy_search(evaluate, mean, initial_std, limits[0], limits[1], **search_kwargs)
+
+    tables = get_tables(best[np.newaxis, :])[0]
+    best_tables = {}
+    for i, level in zip(level_index, levels):
+        best_tables[level.name] = tables[i, :len(level.pump_schedule_table)].copy()
+    logging.info('{} schedule optimisation completed with cost {:.1f}.'.format(pump_system.name, cost))
+    return best_tables, trace
+
+
+def optimise_n_factor_bounds(pump_system, level_names=None, seconds=86400, tariff=PEAK_TARIFF,
+                             penalty=VIOLATION_PENALTY, limits=(0, 100), initial_std=5.0, resolution=1.0,
+                             n_workers=None, simulation_kwargs=None, **search_kwargs):
+    # Search n_mode_min_level, n_mode_max_level and n_mode_control_range of level_names as optimise_schedules does.
+    # n-factor runs on the single system engines (the batch simulator has no n-factor mode), in parallel through
+    # sweeps.run_sweep, so candidates are not terminated early.
+    # Returns the best parameters per level name and the convergence trace
+    levels = _get_levels_to_optimise(pump_system, level_names)
+    simulation_kwargs = {} if simulation_kwargs is None else simulation_kwargs
+
+    def get_parameters(candidate):
+        candidate = np.round(candidate / resolution) * resolution
+        parameters = {}
+        for j, level in enumerate(levels):
+            min_level, max_level, control_range = candidate[3 * j:3 * j + 3]
+            control_range = max(control_range, resolution)
+            parameters['{}.n_mode_min_level'.format(level.name)] = min_level
+            parameters['{}.n_mode_max_level'.format(level.name)] = max(max_level, min_level + control_range)
+            parameters['{}.n_mode_control_range'.format(level.name)] = control_range
+        return parameters
+
+    def evaluate(candidates, cutoff):
+        summary = sweeps.run_sweep(pump_system, [get_parameters(c) for c in candidates], ['n-factor'], n_workers,
+                                   limits, seconds=seconds, **simulation_kwargs)
+        energy = summary[['Peak energy [kWh]', 'Standard energy [kWh]', 'Off-peak energy [kWh]']].values
+        return get_cost(energy, summary['Constraint violations [s]'].values, tariff, penalty)
+
+    mean = np.array([getattr(level, parameter) for level in levels for parameter in N_FACTOR_PARAMETERS],
+                    dtype=np.float64)
+    logging.info('{} n-factor bound optimisation started.'.format(pump_system.name))
+    best, cost, trace = cross_entropy_search(evaluate, mean, initial_std, limits[0], limits[1], **search_kwargs)
+
+    best_parameters = {level.name: {} for level in levels}
+    for name, value in get_parameters(best).items():
+        level_name, _, parameter = name.rpartition('.')
+        best_parameters[level_name][parameter] = value
+    logging.info('{} n-factor bound optimisation completed with cost {:.1f}.'.format(pump_system.name, cost))
+    return best_parameters, trace
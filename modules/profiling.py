@@ -0,0 +1,111 @@
+import collections
+import contextlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+
+class Instrumentation:
+    # Opt-in timers and counters of PumpSystem runs (see PumpSystem.enable_instrumentation):
+    # - time per phase. Run phases (lowering, engine, accounting, saving, power aggregation) are also traced, the per
+    #   second phases of the python engine (scheduling, inflow and mass balance) are only summed
+    # - per level, threshold evaluations (seconds the controller compared the level with its thresholds: none for
+    #   levels without pumps, while interlocked or in validation mode, and fewer on the event integrator, which jumps
+    #   over seconds) and pump switch events
+    # - every sample_every simulated seconds, a sample of the levels and of callback(t, pump_system), if given. The
+    #   engines then run in segments of sample_every seconds
+    def __init__(self, pump_system, sample_every=None, callback=None):
+        if sample_every is not None and sample_every < 1:
+            raise ValueError('Invalid sampling interval specified')
+        self.level_names = [level.name for level in pump_system.levels]
+        self.sample_every = sample_every
+        self.callback = callback
+        self.start_time = time.perf_counter()
+        self.phase_times = collections.defaultdict(float)
+        self.phase_calls = collections.defaultdict(int)
+        self.threshold_evaluations = np.zeros(len(self.level_names), dtype=np.int64)
+        self.pump_switches = np.zeros(len(self.level_names), dtype=np.int64)
+        self.trace_events = []
+        self.samples = []
+
+    def add_time(self, name, start):
+        # add the time since start (a time.perf_counter value) to phase name and return the current time
+        now = time.perf_counter()
+        self.phase_times[name] += now - start
+        self.phase_calls[name] += 1
+        return now
+
+    @contextlib.contextmanager
+    def phase(self, name, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, start)
+            # Chrome trace complete event, times in microseconds
+            self.trace_events.append({'name': name, 'ph': 'X', 'ts': (start - self.start_time) * 1e6,
+                                      'dur': (time.perf_counter() - start) * 1e6, 'pid': os.getpid(), 'tid': 1,
+                                      'args': args})
+
+    def get_segments(self, start, stop):
+        # seconds start up to stop, split after every sampled second
+        if self.sample_every is None:
+            return [(start, stop)]
+        bounds = np.arange(-(-start // self.sample_every) * self.sample_every + 1, stop, self.sample_every)
+        bounds = [start] + bounds.tolist() + [stop]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def count(self, pump_system, start, stop, evaluations):
+        # evaluations per level in seconds start up to stop, or the number of seconds evaluated for controllers that
+        # do not count them per level. Pump switches are counted from the history buffers, which must hold these
+        # seconds and the one before
+        self.threshold_evaluations += evaluations
+        for i, level in enumerate(pump_system.levels):
+            statuses = level.pump_status_history[start - 1 - level.history_offset:stop - level.history_offset]
+            self.pump_switches[i] += np.abs(np.diff(statuses.astype(np.int64))).sum()
+
+    def sample(self, pump_system, t):
+        if self.sample_every is None or t % self.sample_every != 0:
+            return
+        sample = {'Second': t, 'Time [s]': time.perf_counter() - self.start_time,
+                  'Levels': {level.name: level.get_level_history(t) for level in pump_system.levels}}
+        if self.callback is not None:
+            sample['Callback'] = self.callback(t, pump_system)
+        self.samples.append(sample)
+
+    def get_phase_summary(self):
+        return pd.DataFrame({'Time [s]': pd.Series(self.phase_times), 'Calls': pd.Series(self.phase_calls)},
+                            index=pd.Index(list(self.phase_times), name='Phase'))
+
+    def get_level_counters(self):
+        return pd.DataFrame({'Threshold evaluations': self.threshold_evaluations,
+                             'Pump switches': self.pump_switches}, index=pd.Index(self.level_names, name='Level'))
+
+    def get_records(self):
+        # structured log: one record per phase, level and sample
+        records = [{'Type': 'phase', 'Phase': name, 'Time [s]': self.phase_times[name],
+                    'Calls': self.phase_calls[name]} for name in self.phase_times]
+        records += [{'Type': 'level', 'Level': name, 'Threshold evaluations': int(evaluations),
+                     'Pump switches': int(switches)}
+                    for name, evaluations, switches in zip(self.level_names, self.threshold_evaluations,
+                                                           self.pump_switches)]
+        records += [dict(sample, Type='sample') for sample in self.samples]
+        return records
+
+    def write_log(self, path):
+        # JSON lines
+        with open(path, 'w') as f:
+            for record in self.get_records():
+                f.write(json.dumps(record, default=str) + '\n')
+
+    def write_chrome_trace(self, path):
+        # for chrome://tracing or Perfetto. Samples become counter tracks of the levels
+        events = list(self.trace_events)
+        for sample in self.samples:
+            events.append({'name': 'Levels', 'ph': 'C', 'ts': sample['Time [s]'] * 1e6, 'pid': os.getpid(),
+                           'tid': 1, 'args': sample['Levels']})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
@@ -1,11 +1,12 @@
+import contextlib
 import logging
-import math
-import os
-import sys
+import time
 
-import pandas as pd
+import numpy as np
 
-logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+from . import accounting, alarms, controllers, integrators, kernels, online, profiling, snapshots, sweeps, validation, \
+    writers
+from .horizon import Horizon
 
 
 class PumpingLevel:
@@ -20,50 +21,96 @@ class PumpingLevel:
         self.pump_power = pump_power
         self.pump_schedule_table = pump_schedule_table
         self.fissure_water_inflow = fissure_water_inflow
-        self.level_history = [initial_level]
-        self.pump_status_history = [initial_pumps_status]
+        # history buffers are (re)allocated for the horizon by PumpSystem.perform_simulation
+        self.initial_level = initial_level
+        self.initial_pumps_status = initial_pumps_status
+        self.level_history = np.array([initial_level], dtype=np.float64)
+        self.pump_status_history = np.array([initial_pumps_status], dtype=np.int8)
+        self.history_length = 1
+        self.history_offset = 0
         self.fed_to_level = fed_to_level  # to which level does this one pump?
         self.last_outflow = 0
         self.hysteresis = hysteresis
         self.UL_LL = UL_LL
         self.UL_HL = UL_HL
         self.UL_100 = False
-        self.max_pumps = len([1 for r in pump_schedule_table if [150, 150, 150] not in r])
         self.pump_statuses_for_validation = pump_statuses_for_validation  # this is only used in validation mode
         self.n_mode_min_level = n_mode_min_level
         self.n_mode_max_level = n_mode_max_level
         self.n_mode_min_pumps = n_mode_min_pumps
         self.n_mode_max_pumps = n_mode_max_pumps
+        self.initial_n_mode_max_pumps = n_mode_max_pumps  # n_mode_max_pumps is changed by the rules while simulating
         self.n_mode_control_range = n_mode_control_range
         self.n_mode_bottom_offset = n_mode_bottom_offset
         self.n_mode_top_offset = n_mode_top_offset
-        # calculate starting and stopping levels for n-factor mode
-        # 1 = peak, 2 = standard, 3 = off-peak
-        self.n_mode_lower_bound = {3: n_mode_min_level,
-                                   2: n_mode_min_level,
-                                   1: n_mode_max_level - n_mode_control_range}
-        self.n_mode_upper_bound = {3: n_mode_min_level + n_mode_control_range,
-                                   2: n_mode_min_level + n_mode_control_range,
-                                   1: n_mode_max_level}
+        self.update_control_settings()
         self.n_mode_last_change = '000'  # used for n-factor
         logging.info('{} pumping level created.'.format(self.name))
         if self.max_pumps != self.n_mode_max_pumps:
             logging.warning('{} pumping level SCADA and third party max pumps differ ({} vs {})!.'.format(
                 self.name, self.max_pumps, self.n_mode_max_pumps))
 
-    def get_level_history(self, index=None):
-        return self.level_history if index is None else self.level_history[index]
+    def update_control_settings(self):
+        # derived from the schedule table and n-factor parameters. Call again after changing those
+        self.max_pumps = len([1 for r in self.pump_schedule_table if [150, 150, 150] not in r])
+        # calculate starting and stopping levels for n-factor mode
+        # 1 = peak, 2 = standard, 3 = off-peak
+        self.n_mode_lower_bound = {3: self.n_mode_min_level,
+                                   2: self.n_mode_min_level,
+                                   1: self.n_mode_max_level - self.n_mode_control_range}
+        self.n_mode_upper_bound = {3: self.n_mode_min_level + self.n_mode_control_range,
+                                   2: self.n_mode_min_level + self.n_mode_control_range,
+                                   1: self.n_mode_max_level}
+
+    def allocate_history(self, seconds, keep_latest=False):
+        # preallocate typed buffers for the horizon, or one chunk of it (8 + 1 bytes per simulated second).
+        # They start from the initial conditions, or with keep_latest from the latest simulated second
+        level_history = np.empty(seconds, dtype=np.float64)
+        pump_status_history = np.empty(seconds, dtype=np.int8)
+        if keep_latest:
+            latest = self.history_length - 1
+            level_history[0] = self.level_history[latest]
+            pump_status_history[0] = self.pump_status_history[latest]
+            self.history_offset += latest  # second held at index 0
+        else:
+            level_history[0] = self.initial_level
+            pump_status_history[0] = self.initial_pumps_status
+            self.history_offset = 0
+        self.level_history = level_history
+        self.pump_status_history = pump_status_history
+        self.history_length = 1
+
+    def rebase_history(self):
+        # keep only the latest second, at index 0, to make room for the next chunk
+        latest = self.history_length - 1
+        self.level_history[0] = self.level_history[latest]
+        self.pump_status_history[0] = self.pump_status_history[latest]
+        self.history_offset += latest
+        self.history_length = 1
 
-    # @levelHistory.setter
-    def set_latest_level(self, value):
-        self.level_history.append(value)
+    def get_level_history(self, index=None):
+        # returns a view, not a copy (single values are returned as Python scalars)
+        return self.level_history[:self.history_length] if index is None else \
+            self.level_history.item(index - self.history_offset)
 
     def get_pump_status_history(self, index=None):
-        return self.pump_status_history if index is None else self.pump_status_history[index]
-
-    # @levelHistory.setter
-    def set_latest_pump_status(self, value):
-        self.pump_status_history.append(value)
+        # returns a view, not a copy (single values are returned as Python scalars)
+        return self.pump_status_history[:self.history_length] if index is None else \
+            self.pump_status_history.item(index - self.history_offset)
+
+    def set_state(self, index, level, pump_status):
+        index -= self.history_offset
+        self.level_history[index] = level
+        self.pump_status_history[index] = pump_status
+        self.history_length = index + 1
+
+    def fill_state(self, start, stop, levels, pump_status):
+        # seconds start up to stop at once
+        start -= self.history_offset
+        stop -= self.history_offset
+        self.level_history[start:stop] = levels
+        self.pump_status_history[start:stop] = pump_status
+        self.history_length = stop
 
     def get_scada_pump_schedule_table_level(self, pump_index, tariff_index):
         return self.pump_schedule_table[pump_index, tariff_index]
@@ -77,268 +124,359 @@ class PumpingLevel:
     def get_upstream_level_name(self):
         return self.fed_to_level
 
-    def get_fissure_water_inflow(self, current_hour=None, current_minute=None, pumps=None):
-        if isinstance(self.fissure_water_inflow, int) or isinstance(self.fissure_water_inflow, float):  # it is constant
-            return self.fissure_water_inflow
-        else:
-            if self.fissure_water_inflow.shape[1] == 2:  # if 2 columns. Not f(pump)
-                f1 = 0
-                f2 = 1
-                row = math.floor(current_hour)
-            else:  # 3 columns. Is f(pump)
-                f1 = 1
-                f2 = 2
-                row = pumps * 24 - 1 + math.floor(current_hour)
-
-            if math.floor(current_minute) <= 30:
-                col = f1
-            else:
-                col = f2
-
-            return self.fissure_water_inflow[int(row), int(col)]
-
     def set_UL_100(self, bool_):
         self.UL_100 = bool_
 
 
-def get_eskom_tou(current_hour):
-    ch = current_hour
-    if (7 <= ch < 10) or (18 <= ch < 20):  # Eskom peak
-        tou_time_slot = 1
-    elif (0 <= ch < 6) or (22 <= ch < 24):  # Eskom off-peak
-        tou_time_slot = 3
-    else:  # Eskom standard
-        tou_time_slot = 2
-
-    return tou_time_slot
-
-
-def get_current_day_hour_minute(seconds):
-    cd = math.floor(seconds / 86400)  # cd = current day
-    ch = (seconds - cd * 86400) / (60 * 60)  # ch = current hour
-    cm = (seconds - cd * 86400 - math.floor(ch) * 60 * 60) / 60  # cm = current minute
-
-    return cd, ch, cm
-
-
 class PumpSystem:
     def __init__(self, name):
         self.name = name
         self.levels = []
-        self.eskom_tou = [3]
-        self.total_power = []
+        self.eskom_tou = np.array([3], dtype=np.uint8)
+        self.results = None  # accounting.SimulationResults of the latest simulation
+        self.events = None  # alarms.EventLog of the latest simulation, if it logged events
+        self.horizon = None
+        self.dt = 1  # seconds per time step of the latest simulation
+        self.instrumentation = None  # profiling.Instrumentation, see enable_instrumentation
+        self.build_topology()
         logging.info('{} pump system created.'.format(self.name))
 
     def add_level(self, pumping_level):
+        if pumping_level.name in self.level_index:
+            raise ValueError('{} pump system already has a {} pumping level'.format(self.name, pumping_level.name))
         self.levels.append(pumping_level)
+        try:
+            self.build_topology()
+        except ValueError:
+            self.levels.pop()
+            self.build_topology()
+            raise
         logging.info('{} pumping level added to {} pump system.'.format(pumping_level.name, self.name))
 
+    def build_topology(self):
+        # Index of the level names and of which levels pump into which, rebuilt whenever a level is added.
+        # upstream_index[i] is the level that level i pumps to (-1 if none or not added yet). The levels feeding
+        # into level i are feed_index[feed_start[i]:feed_start[i + 1]], in level order
+        self.level_index = {level.name: i for i, level in enumerate(self.levels)}
+        n_levels = len(self.levels)
+        self.upstream_index = np.array([self.level_index.get(level.fed_to_level, -1) for level in self.levels],
+                                       dtype=np.int64)
+        self.feed_lists = [np.flatnonzero(self.upstream_index == i).tolist() for i in range(n_levels)]
+        self.feed_start = np.zeros(n_levels + 1, dtype=np.int64)
+        self.feed_start[1:] = np.cumsum([len(f) for f in self.feed_lists])
+        self.feed_index = np.array([j for f in self.feed_lists for j in f], dtype=np.int64)
+
+        # cycle check: take the levels nothing pumps into, then every level once all levels pumping into it are
+        # taken. Levels on a cycle are never taken
+        feeds_remaining = np.diff(self.feed_start)
+        order = [i for i in range(n_levels) if feeds_remaining[i] == 0]
+        for i in order:
+            upstream = self.upstream_index[i]
+            if upstream >= 0:
+                feeds_remaining[upstream] -= 1
+                if feeds_remaining[upstream] == 0:
+                    order.append(upstream)
+        if len(order) != n_levels:
+            raise ValueError('{} pump system has a cycle in the levels pumped to'.format(self.name))
+
+    def check_topology(self):
+        for level, upstream in zip(self.levels, self.upstream_index):
+            if level.fed_to_level is not None and upstream < 0:
+                raise ValueError('{} pumping level pumps to {}, which is not in the {} pump system'.format(
+                    level.name, level.fed_to_level, self.name))
+
     def get_level_from_index(self, level_number):
         return self.levels[level_number]
 
     def get_level_from_name(self, level_name):
-        for l in self.levels:
-            if l.name == level_name:
-                return l
+        i = self.level_index.get(level_name)
+        return None if i is None else self.levels[i]
 
     def __iter__(self):
         return iter(self.levels)
 
-    def perform_simulation(self, mode, seconds=86400, save=False):
+    def get_horizon(self, seconds, start_date=None, holidays=None, dt=1):
+        # ToU and inflow lookup tables are reused between runs over the same horizon
+        if self.horizon is None or not self.horizon.matches(seconds, start_date, holidays, dt):
+            self.horizon = Horizon(seconds, start_date, holidays, dt)
+        return self.horizon
+
+    def perform_simulation(self, mode, seconds=86400, save=False, engine='python', start_date=None, holidays=None,
+                           integrator='fixed', tolerance=1e-6, chunk_seconds=None, output_format='csv', decimate=None,
+                           tariff=None, dt=1, dt_tolerance=0.5, checkpoint=None, resume=None, events=None,
+                           store_history=True):
         # 86400 = seconds in one day
+        # mode = '1-factor', '2-factor', 'n-factor', 'validation' or a controllers.Controller
+        # engine = 'python' or 'jit'. The jit engine runs on flat arrays (compiled if numba is installed)
+        # start_date (date or datetime) and holidays (path to holidays.csv or dict of date: day type, by default
+        # data processing/holidays.csv) apply weekend, holiday and high/low season ToU, see horizon.Horizon. Without a
+        # start date every day is a low season weekday
+        # integrator = 'fixed' (1 s steps) or 'event', which jumps between events and matches 'fixed' within tolerance.
+        # In validation mode, 'replay' computes all levels at once from the known pump statuses, see validation.replay
+        # chunk_seconds bounds memory on long horizons: the histories then only hold the latest chunk, and every
+        # chunk is saved as soon as it has been simulated. total_power is that of the latest chunk only.
+        # output_format = 'csv', 'parquet', 'feather' or 'npy' (see writers.ResultWriter), decimate = 60 saves every
+        # 60th second only
+        # Energy per ToU slot, cost under tariff (cost per kWh in peak, standard and off-peak) and pump switches are
+        # accumulated in results, see accounting.SimulationResults
+        # dt = 10 simulates in 10 s time steps: the histories and outputs then hold every 10th second only.
+        # dt = 'auto' uses the largest time step whose levels stay within dt_tolerance (in %) of a 1 s simulation
+        # over the first day, see integrators.select_time_step
+        # checkpoint = path saves a snapshot of the state there after every chunk, resume = a snapshot (bytes or path)
+        # continues a simulation over the same horizon from the time step it was taken at, see snapshots. The
+        # histories, results and saved data of a resumed simulation start after that time step
+        # events = True (or an alarms.EventLog, to set its thresholds) logs pump switches, level alarms and interlocks
+        # in events while simulating. store_history = False runs in events-only mode: the histories then only hold
+        # the latest hour and nothing is saved
+        controller = controllers.get_controller(mode)
+        mode = controller.name
+        if dt == 'auto':
+            dt, _ = integrators.select_time_step(self, controller, dt_tolerance, min(seconds, 86400), engine=engine,
+                                                 start_date=start_date, holidays=holidays, integrator=integrator)
         logging.info('{} simulation started in {} mode.'.format(self.name, mode))
 
-        if mode not in ['1-factor', '2-factor', 'n-factor', 'validation']:
-            raise ValueError('Invalid simulation mode specified')
+        if engine not in ['python', 'jit']:
+            raise ValueError('Invalid simulation engine specified')
+        if integrator not in ['fixed', 'event', 'replay'] or integrator == 'replay' and not controller.can_replay:
+            raise ValueError('Invalid simulation integrator specified')
+        if chunk_seconds is not None and chunk_seconds < 1:
+            raise ValueError('Invalid chunk size specified')
+        if not store_history:
+            if save:
+                raise ValueError('Invalid simulation, results cannot be saved without their history')
+            events = True if events is None else events
+            chunk_seconds = alarms.EVENTS_ONLY_CHUNK_SECONDS if chunk_seconds is None else min(
+                chunk_seconds, alarms.EVENTS_ONLY_CHUNK_SECONDS)
+        self.check_topology()
 
         # reset simulation if it has run before
-        if len(self.total_power) > 1:
+        if self.results is not None:
             self.reset_pumpsystem_state()
 
-        for t in range(1, seconds):  # start at 1, because initial conditions are specified
-            _, ch, cm = get_current_day_hour_minute(t)
-
-            tou_time_slot = get_eskom_tou(ch)
-            self.eskom_tou.append(tou_time_slot)
-
-            for level in self.levels:
-                # scheduling algorithm
-                if mode == '1-factor' or mode == '2-factor':
-                    upstream_dam_name = level.get_upstream_level_name()
-                    if mode == '1-factor' or upstream_dam_name is None:
-                        upper_dam_level = 45
-                    else:
-                        upper_dam_level = self.get_level_from_name(upstream_dam_name).get_level_history(t - 1)
-
-                    if upper_dam_level >= level.UL_HL:
-                        level.set_UL_100(True)
-                    if upper_dam_level <= level.UL_LL:
-                        level.set_UL_100(False)
-
-                    if not level.UL_100:
-                        pumps_required = level.get_pump_status_history(t - 1)
-                        pumps_required_temp = pumps_required
-
-                        do_next_check = False
-
-                        for p in range(1, level.max_pumps + 1):
-                            dam_level = level.get_level_history(t - 1)
-                            pump_level = level.get_scada_pump_schedule_table_level(p - 1, tou_time_slot - 1)
-
-                            if dam_level >= pump_level:
-                                pumps_required_temp = p
-                                do_next_check = True
-
-                            if dam_level < (
-                                        level.get_scada_pump_schedule_table_level(0,
-                                                                                  tou_time_slot - 1) - level.hysteresis):
-                                pumps_required = 0
-                                do_next_check = False
-
-                        if pumps_required >= (pumps_required_temp + 2):
-                            pumps_required = pumps_required_temp + 1
-                        if do_next_check:
-                            if pumps_required_temp > pumps_required:
-                                pumps_required = pumps_required_temp
-                    else:
-                        pumps_required = 0
-
-                elif mode == 'n-factor':
-                    prev_level = level.get_level_history(t - 1)
-                    prev_pumps = level.get_pump_status_history(t - 1)
-                    pump_change = 0
-
-                    if level.name == '31L':
-                        if self.get_level_from_name('20L').get_level_history(t - 1) > 70:
-                            level.n_mode_max_pumps = 1
-                        if self.get_level_from_name('20L').get_level_history(t - 1) < 60:
-                            level.n_mode_max_pumps = 2
-                        if level.get_level_history(t - 1) >= (level.n_mode_max_level) and t < 42900:
-                            level.n_mode_max_pumps = 2
-
-                    if level.name == '20L':
-                        if tou_time_slot == 1:
-                            if level.get_level_history(t - 1) < 75:
-                                level.n_mode_max_pumps = 1
-                            if level.get_level_history(t - 1) < 60:
-                                level.n_mode_max_pumps = 0
-                            if level.get_level_history(t - 1) > 80:
-                                level.n_mode_max_pumps = 1
-                        else:
-                            level.n_mode_max_pumps = 2
-
-                    if level.name == 'IPC':
-                        if tou_time_slot == 1:
-                            level.n_mode_max_pumps = self.get_level_from_name('20L').n_mode_max_pumps
-                            if level.get_level_history(t - 1) > 90:
-                                level.n_mode_max_pumps = 1
-                        else:
-                            if self.get_level_from_name('Surface').get_level_history(t - 1) < 90 and t < 39600:
-                                level.n_mode_max_pumps = 3
-                            if level.get_level_history(t - 1) > 80 and t > 39600 and t < 64800:
-                                level.n_mode_max_pumps = 3
-                            if self.get_level_from_name('Surface').get_level_history(t - 1) < 90 and t > 57600:
-                                level.n_mode_max_pumps = 3
-                            if self.get_level_from_name('Surface').get_level_history(t - 1) >= 95 and t < 39600:
-                                level.n_mode_max_pumps = 2
-                            if self.get_level_from_name('Surface').get_level_history(
-                                            t - 1) >= 97.5 and level.get_level_history(t - 1) < 60:
-                                level.n_mode_max_pumps = 1
-                            if level.get_level_history(t - 1) < 50 and self.get_level_from_name(
-                                    'Surface').get_level_history(t - 1) >= 90 and t > 39600:
-                                level.n_mode_max_pumps = 1
-                            if t > 70200:
-                                level.n_mode_max_pumps = 2
-                            if t > 77400:
-                                level.n_mode_max_pumps = 3
-                            if t > 81000:
-                                level.n_mode_max_pumps = 2
-
-                    max_pumps = level.n_mode_max_pumps
-
-                    for p in range(0, max_pumps):
-                        # check if pumps should be switched on
-                        check_lev = (level.n_mode_upper_bound[tou_time_slot] + p * level.n_mode_top_offset)
-                        if prev_level >= check_lev:
-                            this_change = check_lev
-                            if this_change != level.n_mode_last_change:
-                                pump_change = 1
-                                level.n_mode_last_change = this_change
-                                break
-                        # check if pumps should be switched off
-                        check_lev2 = (level.n_mode_lower_bound[tou_time_slot] - p * level.n_mode_bottom_offset)
-                        if prev_level <= check_lev2:
-                            this_change = check_lev2
-                            if (level.n_mode_last_change == '000') or (this_change < level.n_mode_last_change) or (
-                                        tou_time_slot != self.eskom_tou[-2]):
-                                pump_change = -1
-                                level.n_mode_last_change = this_change
-                                break
-
-                    pumps_required = prev_pumps + pump_change
-                    if pumps_required < level.n_mode_min_pumps:
-                        pumps_required = level.n_mode_min_pumps
-                    elif pumps_required > max_pumps:
-                        pumps_required = max_pumps
-
-                else:  # validation mode, so use actual statuses
-                    pumps_required = level.pump_statuses_for_validation[t]
-
-                # calculate and update simulation values
-                pumps = pumps_required
-                outflow = pumps * level.pump_flow
-
-                level.set_last_outflow(outflow)
-
-                additional_in_flow = 0
-                for level2 in self.levels:
-                    if level2.fed_to_level == level.name:
-                        additional_in_flow += level2.get_last_outflow()
-
-                level_new = level.get_level_history(t - 1) + 100 / level.capacity * (
-                    level.get_fissure_water_inflow(ch, cm, pumps) + additional_in_flow - outflow)
-                level.set_latest_level(level_new)
-                level.set_latest_pump_status(pumps)
-
-        # calculate pump system total power
-        # can do it in the loop above, though
-        power_list = []
+        # size the state buffers for the whole horizon (or one chunk) up front
+        horizon = self.get_horizon(seconds, start_date, holidays, dt)
+        self.eskom_tou = horizon.eskom_tou
+        self.dt = horizon.dt
+        steps = horizon.steps
+        first = 1  # start at 1, because initial conditions are specified
+        if resume is not None:
+            first = snapshots.restore_snapshot(self, snapshots.read_snapshot(resume) if isinstance(resume, str)
+                                               else resume) + 1
+            if self.dt != horizon.dt:
+                raise ValueError('Invalid snapshot, it was taken with {} s time steps'.format(self.dt))
+        chunk_steps = max(steps - 1, 1) if chunk_seconds is None else max(chunk_seconds // horizon.dt, 1)
         for level in self.levels:
-            power_list.append(pd.DataFrame(level.get_pump_status_history()) * level.pump_power)
-        self.total_power = pd.concat(power_list, axis=1).sum(axis=1).values
-
-        logging.info('{} simulation completed in {} mode.'.format(self.name, mode))
-
-        if save:
-            self._save_simulation_results(mode, seconds)
-
-    def _save_simulation_results(self, mode, seconds):
-        df_list = []
-        index = range(0, seconds)
+            level.allocate_history(min(steps - first + 1, chunk_steps + 1), keep_latest=resume is not None)
+        self.results = accounting.SimulationResults(self, tariff, dt=horizon.dt)
+        if resume is None:
+            self.results.add(self, 0, 1)
+        writer = writers.ResultWriter(self.name, mode, seconds, output_format, decimate, dt=horizon.dt,
+                                      first_second=first * horizon.dt if resume is not None else 0) if save else None
+
+        with self._phase('Lowering'):
+            params = controller.lower(self, horizon)
+            arrays = None
+            if integrator == 'fixed' and engine == 'jit':
+                if kernels.can_simulate(controller):
+                    arrays = kernels.lower_pump_system(self, horizon)
+                else:
+                    logging.warning('{} controller is not compiled, using the python engine.'.format(mode))
+
+        self.events = alarms.EventLog() if events is True else events or None
+        if self.events is not None:
+            self.events.start(self, horizon, params)
+            if resume is None:
+                self.events.add(self, 0, 1)
+
+        saved = 0 if resume is None else first  # time steps saved so far
+        try:
+            for start in range(first, steps, chunk_steps):
+                stop = min(start + chunk_steps, steps)
+                self._run_engine(controller, params, horizon, start, stop, integrator, tolerance, arrays)
+                with self._phase('Accounting'):
+                    self.results.add(self, start, stop)
+                    if self.events is not None:
+                        self.events.add(self, start, stop)
+                if checkpoint is not None:
+                    snapshots.save_snapshot(self, checkpoint)
+
+                if stop < steps:
+                    if save:
+                        with self._phase('Save'):
+                            saved = self._save_simulation_results(writer, saved)
+                    for level in self.levels:
+                        level.rebase_history()
+
+            logging.info('{} simulation completed in {} mode.'.format(self.name, mode))
+
+            if save:
+                with self._phase('Save'):
+                    self._save_simulation_results(writer, saved)
+                    writer.close()
+                logging.info('{} simulation data saved.'.format(mode))
+        finally:
+            if writer is not None and writer.file is not None:  # the simulation failed before the last save
+                writer.close()
+
+    def take_snapshot(self):
+        # the state after the latest simulated time step, as bytes, see snapshots.take_snapshot
+        return snapshots.take_snapshot(self)
+
+    def restore_snapshot(self, snapshot):
+        return snapshots.restore_snapshot(self, snapshot)
+
+    def save_config(self, path):
+        # see snapshots.save_config, snapshots.load_config loads the pump system again
+        snapshots.save_config(self, path)
+
+    def sweep(self, param_grid, modes, n_workers=None, **simulation_kwargs):
+        # run every scenario in param_grid (see sweeps.apply_parameters) in every mode in parallel.
+        # Returns a summary table with one row per scenario and mode
+        return sweeps.run_sweep(self, param_grid, modes, n_workers, **simulation_kwargs)
+
+    def simulate_online(self, mode, **online_kwargs):
+        # start an online simulation from the initial conditions, see online.OnlineSimulation
+        return online.OnlineSimulation(self, mode, **online_kwargs)
+
+    def enable_instrumentation(self, sample_every=None, callback=None):
+        # time and count the following runs, see profiling.Instrumentation. Returns the instrumentation
+        self.instrumentation = profiling.Instrumentation(self, sample_every, callback)
+        return self.instrumentation
+
+    def disable_instrumentation(self):
+        instrumentation = self.instrumentation
+        self.instrumentation = None
+        return instrumentation
+
+    def _phase(self, name, **args):
+        return contextlib.nullcontext() if self.instrumentation is None else self.instrumentation.phase(name, **args)
+
+    def _run_engine(self, controller, params, horizon, start, stop, integrator='fixed', tolerance=1e-6, arrays=None,
+                    inflow_blocks=None):
+        # simulate seconds start up to stop, with params from controller.lower. arrays (from
+        # kernels.lower_pump_system) selects the jit engine
+        controller.load_state(self, params)
+        instrumentation = self.instrumentation
+        counters = getattr(params, 'evaluations', None)  # per level, see controllers.Controller
+        if counters is not None:  # only counted while instrumented
+            params.count_evaluations[0] = instrumentation is not None
+        if instrumentation is None:
+            self._run_segment(controller, params, horizon, start, stop, integrator, tolerance, arrays, inflow_blocks)
+        else:
+            name = 'Python engine' if arrays is None else 'Jit engine'
+            name = {'event': 'Event integrator', 'replay': 'Replay'}.get(integrator, name)
+            for segment_start, segment_stop in instrumentation.get_segments(start, stop):
+                if counters is not None:
+                    counters[:] = 0
+                with instrumentation.phase(name, start=segment_start, stop=segment_stop):
+                    evaluations = self._run_segment(controller, params, horizon, segment_start, segment_stop,
+                                                    integrator, tolerance, arrays, inflow_blocks)
+                instrumentation.count(self, segment_start, segment_stop,
+                                      evaluations if counters is None else counters)
+                controller.store_state(self, params)
+                instrumentation.sample(self, segment_stop - 1)
+        controller.store_state(self, params)
+
+    def _run_segment(self, controller, params, horizon, start, stop, integrator, tolerance, arrays, inflow_blocks):
+        # returns the number of seconds the control law was evaluated
+        if integrator == 'replay':
+            validation.replay(self, params, horizon, start, stop, inflow_blocks)
+            return stop - start
+        if integrator == 'event':
+            jumps = integrators.perform_event_simulation(self, controller, params, horizon, tolerance, start, stop,
+                                                         inflow_blocks)
+            return stop - start - sum([end - t for t, end in jumps])
+        if arrays is not None:
+            kernels.simulate(self, controller, params, arrays, start, stop)
+        else:
+            self._perform_python_simulation(controller, params, horizon, start, stop, inflow_blocks)
+        return stop - start
+
+    def _perform_python_simulation(self, controller, params, horizon, start=1, stop=None, inflow_blocks=None):
+        block_index = horizon.block_index
+        if inflow_blocks is None:
+            inflow_blocks = [horizon.get_inflow_blocks(level.fissure_water_inflow) for level in self.levels]
+
+        for t in range(start, horizon.steps if stop is None else stop):
+            self._simulate_step(controller, params, t, block_index.item(t), inflow_blocks, self.instrumentation)
+
+    def _simulate_step(self, controller, params, t, block, inflow_blocks, instrumentation=None):
+        # the phases of the step are timed with instrumentation, if given
+        if instrumentation is not None:
+            phase_start = time.perf_counter()
+
+        # scheduling algorithm: the controller decides the pumps of every level from the state of second t - 1
+        levels = np.array([level.get_level_history(t - 1) for level in self.levels])
+        statuses = np.array([level.get_pump_status_history(t - 1) for level in self.levels])
+        pumps_required = np.empty(len(self.levels))
+        controller.decide(t, self.eskom_tou.item(t), self.eskom_tou.item(t - 1), levels, statuses, pumps_required,
+                          params)
+        if instrumentation is not None:
+            phase_start = instrumentation.add_time('Scheduling', phase_start)
+
+        fissure_water_inflows = [inflow.item(0 if len(inflow) == 1 else int(pumps_required.item(i)), block)
+                                 for i, inflow in enumerate(inflow_blocks)]
+        if instrumentation is not None:
+            phase_start = instrumentation.add_time('Inflow', phase_start)
+
+        for i, level in enumerate(self.levels):
+            # calculate and update simulation values
+            pumps = pumps_required.item(i)
+            outflow = pumps * level.pump_flow
+
+            level.set_last_outflow(outflow)
+
+            additional_in_flow = 0
+            for j in self.feed_lists[i]:
+                additional_in_flow += self.levels[j].get_last_outflow()
+
+            level_new = level.get_level_history(t - 1) + 100 / level.capacity * self.dt * (
+                fissure_water_inflows[i] + additional_in_flow - outflow)
+            level.set_state(t, level_new, pumps)
+        if instrumentation is not None:
+            instrumentation.add_time('Mass balance', phase_start)
+
+    @property
+    def total_power(self):
+        # pump system power of the seconds in the history buffers, only computed when asked for
+        return [] if self.results is None else self._get_total_power()
+
+    def _get_total_power(self):
+        total_power = np.zeros(self.levels[0].history_length if self.levels else len(self.eskom_tou))
+        for level in self.levels:
+            total_power += level.get_pump_status_history() * float(level.pump_power)
+        return total_power
+
+    def _save_simulation_results(self, writer, first_second):
+        # write the seconds from first_second up to the latest one straight from the history buffers, without
+        # building intermediate frames. Returns the next second to save
+        with self._phase('Power aggregation'):
+            total_power = self._get_total_power()
+        offset = self.levels[0].history_offset if self.levels else 0
+        first = first_second - offset
+        end = offset + len(total_power)
+        data = {}
         for level in self.levels:
-            data_level = level.get_level_history()
-            data_schedule = level.get_pump_status_history()
-            data = {level.name + " Level": data_level,
-                    level.name + " Status": data_schedule}
-            df_list.append(pd.DataFrame(data=data, index=index))
-        df = pd.concat(df_list, axis=1)
-
-        data = {'Pump system total power': self.total_power,
-                'Eskom ToU': self.eskom_tou}
-        df = pd.concat([df, pd.DataFrame(data=data, index=index)], axis=1)
-        df.index.name = 'seconds'
-
-        os.makedirs(r'output/', exist_ok=True)
-        df.to_csv('output/{}_simulation_data_export_{}.csv.gz'.format(self.name, mode), compression='gzip')
-        logging.info('{} simulation data saved.'.format(mode))
+            data[level.name + " Level"] = level.get_level_history()[first:]
+            data[level.name + " Status"] = level.get_pump_status_history()[first:]
+        data['Pump system total power'] = total_power[first:]
+        data['Eskom ToU'] = self.eskom_tou[first_second:end]
+        writer.write(first_second, data)
+        return end
 
     def reset_pumpsystem_state(self):
-        self.eskom_tou = [3]
-        self.total_power = []
+        self.eskom_tou = np.array([3], dtype=np.uint8)
+        self.results = None
 
         for level in self.levels:
-            level.level_history = [level.level_history[0]]
-            level.pump_status_history = [level.pump_status_history[0]]
+            level.level_history = np.array([level.initial_level], dtype=np.float64)
+            level.pump_status_history = np.array([level.initial_pumps_status], dtype=np.int8)
+            level.history_length = 1
+            level.history_offset = 0
             level.last_outflow = 0
+            # control state, see controllers.Controller.store_state
+            level.UL_100 = False
+            level.n_mode_max_pumps = level.initial_n_mode_max_pumps
+            level.n_mode_last_change = '000'
 
         logging.info('{} pumping system successfully cleared.'.format(self.name))
@@ -0,0 +1,107 @@
+import json
+import logging
+
+import numpy as np
+
+from .controllers import NO_CHANGE
+
+# PumpingLevel arguments stored in a configuration, in the order PumpingLevel takes them
+LEVEL_FIELDS = ['name', 'capacity', 'initial_level', 'pump_flow', 'pump_power', 'pump_schedule_table',
+                'initial_pumps_status', 'fissure_water_inflow', 'hysteresis', 'UL_LL', 'UL_HL', 'fed_to_level',
+                'pump_statuses_for_validation', 'n_mode_min_pumps', 'n_mode_max_pumps', 'n_mode_min_level',
+                'n_mode_max_level', 'n_mode_control_range', 'n_mode_bottom_offset', 'n_mode_top_offset']
+
+# A snapshot is a header followed by one record per level, in level order. Snapshots are plain bytes, so they can be
+# stored or sent to worker processes as is and restored without parsing
+SNAPSHOT_HEADER = np.dtype([('step', np.int64), ('dt', np.int64), ('n_levels', np.int64)])
+SNAPSHOT_LEVEL = np.dtype([('level', np.float64), ('pump_status', np.int64), ('last_outflow', np.float64),
+                           ('UL_100', np.bool_), ('n_mode_max_pumps', np.int64), ('n_mode_last_change', np.float64)])
+
+
+def get_config(pump_system):
+    # the pump system as a JSON-serialisable dict and a dict of the arrays it refers to by name
+    config = {'name': pump_system.name, 'levels': []}
+    arrays = {}
+    for i, level in enumerate(pump_system.levels):
+        fields = {}
+        for field in LEVEL_FIELDS:
+            # the configured n_mode_max_pumps, the rules change n_mode_max_pumps while simulating
+            value = level.initial_n_mode_max_pumps if field == 'n_mode_max_pumps' else getattr(level, field)
+            if isinstance(value, (np.ndarray, list)):
+                key = '{}.{}'.format(i, field)
+                arrays[key] = np.asarray(value)
+                value = {'array': key}
+            elif isinstance(value, np.generic):
+                value = value.item()
+            fields[field] = value
+        config['levels'].append(fields)
+    return config, arrays
+
+
+def save_config(pump_system, path):
+    # one compressed .npz file with the configuration (as JSON) and its arrays: schedule tables, inflow profiles and
+    # validation statuses. Histories and results are not stored, see take_snapshot for the state
+    config, arrays = get_config(pump_system)
+    np.savez_compressed(path, config=np.array(json.dumps(config)), **arrays)
+    logging.info('{} pump system configuration saved to {}.'.format(pump_system.name, path))
+
+
+def load_config(path):
+    # the pump system saved with save_config, in its initial state
+    from .pumpingsystem import PumpSystem, PumpingLevel
+
+    with np.load(path) as data:
+        config = json.loads(data['config'].item())
+        pump_system = PumpSystem(config['name'])
+        for fields in config['levels']:
+            fields = {field: data[value['array']] if isinstance(value, dict) else value
+                      for field, value in fields.items()}
+            pump_system.add_level(PumpingLevel(**fields))
+    return pump_system
+
+
+def take_snapshot(pump_system):
+    # the state after the latest simulated time step: levels, pump statuses, last outflows and control state
+    levels = pump_system.levels
+    header = np.zeros(1, dtype=SNAPSHOT_HEADER)
+    header['step'] = levels[0].history_offset + levels[0].history_length - 1 if levels else 0
+    header['dt'] = pump_system.dt
+    header['n_levels'] = len(levels)
+    records = np.zeros(len(levels), dtype=SNAPSHOT_LEVEL)
+    for i, level in enumerate(levels):
+        records[i] = (level.get_level_history()[-1], level.get_pump_status_history()[-1], level.last_outflow,
+                      level.UL_100, level.n_mode_max_pumps,
+                      NO_CHANGE if level.n_mode_last_change == '000' else level.n_mode_last_change)
+    return header.tobytes() + records.tobytes()
+
+
+def restore_snapshot(pump_system, snapshot):
+    # Continue from snapshot (bytes from take_snapshot): the histories only hold its time step, which is returned
+    header = np.frombuffer(snapshot, dtype=SNAPSHOT_HEADER, count=1)[0]
+    if header['n_levels'] != len(pump_system.levels):
+        raise ValueError('Invalid snapshot, it has {} levels instead of {}'.format(header['n_levels'],
+                                                                                  len(pump_system.levels)))
+    records = np.frombuffer(snapshot, dtype=SNAPSHOT_LEVEL, offset=SNAPSHOT_HEADER.itemsize)
+    step = int(header['step'])
+    for level, record in zip(pump_system.levels, records):
+        level.level_history = np.array([record['level']], dtype=np.float64)
+        level.pump_status_history = np.array([record['pump_status']], dtype=np.int8)
+        level.history_offset = step
+        level.history_length = 1
+        level.last_outflow = record['last_outflow'].item()
+        level.UL_100 = bool(record['UL_100'])
+        level.n_mode_max_pumps = int(record['n_mode_max_pumps'])
+        last_change = record['n_mode_last_change'].item()
+        level.n_mode_last_change = '000' if last_change == NO_CHANGE else last_change
+    pump_system.dt = int(header['dt'])
+    return step
+
+
+def save_snapshot(pump_system, path):
+    with open(path, 'wb') as f:
+        f.write(take_snapshot(pump_system))
+
+
+def read_snapshot(path):
+    with open(path, 'rb') as f:
+        return f.read()
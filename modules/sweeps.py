@@ -0,0 +1,152 @@
+import concurrent.futures
+import copy
+import itertools
+import logging
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+# read-only level inputs that are placed in shared memory instead of being pickled for every worker
+SHARED_FIELDS = ['pump_statuses_for_validation', 'fissure_water_inflow']
+
+_worker = {}
+
+
+def get_scenarios(param_grid):
+    # a dict of parameter: values is expanded to every combination, a list of dicts is used as is
+    if isinstance(param_grid, dict):
+        names = list(param_grid)
+        return [dict(zip(names, values)) for values in itertools.product(*[param_grid[n] for n in names])]
+    return list(param_grid)
+
+
+def apply_parameters(pump_system, parameters):
+    # Parameters are named '<level name>.<attribute>', e.g. '41L.pump_schedule_table' or '31L.n_mode_max_level'.
+    # 'inflow_scale' scales the inflow of all levels, '<level name>.inflow_scale' that of one level.
+    # The levels are copied shallowly, so the input arrays are shared with pump_system and not copied
+    system = copy.copy(pump_system)
+    system.levels = [copy.copy(level) for level in pump_system.levels]
+    for name, value in parameters.items():
+        level_name, _, attribute = name.rpartition('.')
+        if level_name == '' and attribute != 'inflow_scale':
+            raise ValueError('Invalid sweep parameter {}'.format(name))
+        levels = system.levels if level_name == '' else [system.get_level_from_name(level_name)]
+        if None in levels:
+            raise ValueError('Invalid sweep parameter {}, no such pumping level'.format(name))
+
+        for level in levels:
+            if attribute == 'inflow_scale':
+                level.fissure_water_inflow = level.fissure_water_inflow * value
+            elif hasattr(level, attribute):
+                setattr(level, attribute, value)
+                if attribute == 'n_mode_max_pumps':  # the configured value, which runs start from
+                    level.initial_n_mode_max_pumps = value
+            else:
+                raise ValueError('Invalid sweep parameter {}'.format(name))
+            level.update_control_settings()
+
+    return system
+
+
+def summarise_simulation(pump_system, limits=(0, 100)):
+    # energy (and cost) per ToU slot, pump starts, level extremes and the number of seconds any level is outside
+    # limits
+    totals = pump_system.results.summary().loc['Total']
+    summary = {'Energy [kWh]': totals['Energy [kWh]'],
+               'Peak energy [kWh]': totals['Peak energy [kWh]'],
+               'Standard energy [kWh]': totals['Standard energy [kWh]'],
+               'Off-peak energy [kWh]': totals['Off-peak energy [kWh]']}
+    if 'Cost' in totals:
+        summary['Cost'] = totals['Cost']
+    summary['Pump starts'] = int(totals['Pump starts'])
+
+    for i, level in enumerate(pump_system.levels):
+        summary['{} min level'.format(level.name)] = pump_system.results.min_level[i]
+        summary['{} max level'.format(level.name)] = pump_system.results.max_level[i]
+
+    if tuple(limits) == pump_system.results.limits:
+        summary['Constraint violations [s]'] = pump_system.results.violations
+    else:  # counted from the histories instead
+        violations = np.zeros(pump_system.levels[0].history_length, dtype=np.bool_)
+        for level in pump_system.levels:
+            history = level.get_level_history()
+            violations |= (history < limits[0]) | (history > limits[1])
+        summary['Constraint violations [s]'] = int(violations.sum())
+
+    return summary
+
+
+def _share_inputs(pump_system):
+    # copy of the pump system in its initial state (without histories, control state, event log or instrumentation),
+    # with its read-only input arrays moved to one shared memory block
+    template = copy.copy(pump_system)
+    template.levels = [copy.copy(level) for level in pump_system.levels]
+    template.reset_pumpsystem_state()
+    template.horizon = None
+    template.events = None
+    template.instrumentation = None
+
+    arrays = []
+    layout = []  # (level index, field, byte offset, shape)
+    offset = 0
+    for i, level in enumerate(template.levels):
+        for field in SHARED_FIELDS:
+            value = getattr(level, field)
+            if isinstance(value, np.ndarray):
+                value = np.ascontiguousarray(value, dtype=np.float64)
+                arrays.append(value)
+                layout.append((i, field, offset, value.shape))
+                offset += value.nbytes
+                setattr(level, field, None)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for value, (_, _, offset, shape) in zip(arrays, layout):
+        np.ndarray(shape, dtype=np.float64, buffer=shm.buf, offset=offset)[...] = value
+
+    return template, shm, layout
+
+
+def _init_worker(template, shm_name, layout, simulation_kwargs, limits):
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    for i, field, offset, shape in layout:
+        value = np.ndarray(shape, dtype=np.float64, buffer=shm.buf, offset=offset)
+        value.flags.writeable = False
+        setattr(template.levels[i], field, value)
+
+    _worker.update({'pump_system': template, 'shm': shm, 'simulation_kwargs': simulation_kwargs, 'limits': limits})
+
+
+def _run_scenario(task):
+    scenario, parameters, mode = task
+    system = apply_parameters(_worker['pump_system'], parameters)
+    system.perform_simulation(mode, **_worker['simulation_kwargs'])
+
+    row = {'Scenario': scenario, 'Mode': mode}
+    row.update(parameters)
+    row.update(summarise_simulation(system, _worker['limits']))
+    return row
+
+
+def run_sweep(pump_system, param_grid, modes, n_workers=None, limits=(0, 100), **simulation_kwargs):
+    # Simulate every scenario in param_grid in every mode on a process pool and return one summary row per run.
+    # simulation_kwargs are passed on to perform_simulation (seconds, engine, integrator, ...)
+    scenarios = get_scenarios(param_grid)
+    tasks = [(i, parameters, mode) for i, parameters in enumerate(scenarios) for mode in modes]
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    logging.info('{} sweep of {} runs started on {} workers.'.format(pump_system.name, len(tasks), n_workers))
+
+    template, shm, layout = _share_inputs(pump_system)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(n_workers, initializer=_init_worker,
+                                                    initargs=(template, shm.name, layout, simulation_kwargs,
+                                                              limits)) as executor:
+            rows = list(executor.map(_run_scenario, tasks, chunksize=max(1, len(tasks) // (4 * n_workers))))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    logging.info('{} sweep completed.'.format(pump_system.name))
+    return pd.DataFrame(rows)
@@ -0,0 +1,60 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+
+def replay(pump_system, params, horizon, start=1, stop=None, inflow_blocks=None):
+    # Validation mode without stepping: the pump statuses of every second are known (params from
+    # controllers.ValidationController.lower), so the outflows, feeds and inflows of all seconds are computed at once
+    # and every level is the cumulative sum of its increments. Feeds only depend on the statuses, so the levels do
+    # not depend on each other. np.add.accumulate adds the increments one at a time, so the levels are the same
+    # floats the fixed-step simulation produces. Simulates time steps start up to stop
+    levels = pump_system.levels
+    stop = horizon.steps if stop is None else stop
+    if inflow_blocks is None:
+        inflow_blocks = [horizon.get_inflow_blocks(level.fissure_water_inflow) for level in levels]
+    blocks = horizon.block_index[start:stop]
+    statuses = params.validation[:, start:stop]
+
+    outflows = [statuses[i] * level.pump_flow for i, level in enumerate(levels)]
+    # feeds of later levels are still those of the previous second, see PumpSystem._simulate_step
+    previous_outflows = [np.concatenate([[level.get_last_outflow()], outflows[i][:-1]]) for i, level in
+                         enumerate(levels)]
+
+    for i, (level, inflow) in enumerate(zip(levels, inflow_blocks)):
+        additional_in_flow = np.zeros(stop - start)
+        for j in pump_system.feed_lists[i]:
+            additional_in_flow += outflows[j] if j < i else previous_outflows[j]
+        rows = 0 if len(inflow) == 1 else statuses[i].astype(np.int64)
+        increments = np.empty(stop - start + 1)
+        increments[0] = level.get_level_history(start - 1)
+        increments[1:] = 100 / level.capacity * horizon.dt * (inflow[rows, blocks] + additional_in_flow - outflows[i])
+        level.fill_state(start, stop, np.add.accumulate(increments)[1:], statuses[i])
+
+    for i, level in enumerate(levels):
+        level.set_last_outflow(outflows[i][-1])
+    logging.info('{} validation replayed over {} time steps.'.format(pump_system.name, stop - start))
+
+
+def get_fit_metrics(pump_system, measured):
+    # Fit of the simulated levels (of the latest simulation, usually in validation mode) to measured, a table with a
+    # '<level> Level' column per second (e.g. CS3_data_for_validation.csv.gz), over the time steps both cover:
+    # RMSE, mean and largest absolute deviation (in %), bias (mean of simulated - measured) and drift (slope of the
+    # deviation, in % per day). Levels without measurements are left out
+    rows = {}
+    for level in pump_system.levels:
+        name = level.name + ' Level'
+        if name not in measured:
+            continue
+        simulated = level.get_level_history()
+        first = level.history_offset  # second of the first time step in the history buffers
+        expected = np.asarray(measured[name])[first * pump_system.dt::pump_system.dt]
+        n = min(len(expected), len(simulated))
+        deviation = simulated[:n] - expected[:n]
+        days = (first + np.arange(n)) * pump_system.dt / 86400
+        days = days - days.mean()
+        rows[level.name] = {'RMSE': np.sqrt(np.mean(deviation ** 2)), 'Mean deviation': np.abs(deviation).mean(),
+                            'Max deviation': np.abs(deviation).max(), 'Bias': deviation.mean(),
+                            'Drift [%/day]': (days * deviation).sum() / max((days ** 2).sum(), 1e-12)}
+    return pd.DataFrame.from_dict(rows, orient='index').rename_axis('Level')
@@ -0,0 +1,94 @@
+import gzip
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional, it is only needed for the parquet and feather formats
+    pyarrow = None
+
+# file name extension of every output format. npy writes a directory with one .npy file per column
+OUTPUT_FORMATS = {'csv': '.csv.gz', 'parquet': '.parquet', 'feather': '.feather', 'npy': ''}
+
+
+def get_output_path(name, mode, output_format='csv', directory='output'):
+    return os.path.join(directory, '{}_simulation_data_export_{}{}'.format(name, mode, OUTPUT_FORMATS[output_format]))
+
+
+class ResultWriter:
+    # Writes simulation results chunk by chunk, so only one chunk is formatted in memory at a time.
+    # csv appends every chunk to the gzip CSV export, parquet and feather write a row group / record batch per chunk
+    # and npy writes every column into a memory mapped .npy file. decimate = 60 only keeps every 60th second.
+    # Rows are time steps of dt seconds, from first_second onwards
+    def __init__(self, name, mode, seconds, output_format='csv', decimate=None, directory='output', dt=1,
+                 first_second=0):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError('Invalid output format specified')
+        if output_format in ['parquet', 'feather'] and pyarrow is None:
+            raise ImportError('pyarrow is required for the {} output format'.format(output_format))
+        if decimate is not None and decimate < 1:
+            raise ValueError('Invalid decimation specified')
+
+        self.name = name
+        self.mode = mode
+        self.output_format = output_format
+        self.decimate = decimate
+        self.dt = dt
+        step = dt if decimate is None else int(np.lcm(dt, decimate))
+        self.n_rows = len(range(-(-first_second // step) * step, seconds, step))
+        self.rows_written = 0
+        self.path = get_output_path(name, mode, output_format, directory)
+        self.file = None
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, start, data):
+        # data is a dict of column: values of the time steps from start onwards, in column order
+        seconds = np.arange(start, start + len(next(iter(data.values())))) * self.dt
+        if self.decimate is not None:
+            keep = seconds % self.decimate == 0
+            seconds = seconds[keep]
+            data = {column: values[keep] for column, values in data.items()}
+        if len(seconds) == 0:
+            return
+
+        if self.output_format == 'csv':
+            if self.file is None:
+                # zlib's default level: much faster to encode than gzip's 9, for slightly larger files
+                self.file = gzip.open(self.path, 'wt', compresslevel=6, newline='')
+            df = pd.DataFrame(data=data, index=pd.Index(seconds, name='seconds'), copy=False)
+            df.to_csv(self.file, header=self.rows_written == 0)
+        elif self.output_format == 'npy':
+            if self.file is None:
+                os.makedirs(self.path, exist_ok=True)
+                self.file = {column: np.lib.format.open_memmap(os.path.join(self.path, column + '.npy'), mode='w+',
+                                                               dtype=values.dtype, shape=(self.n_rows,))
+                             for column, values in [('seconds', seconds)] + list(data.items())}
+            stop = self.rows_written + len(seconds)
+            self.file['seconds'][self.rows_written:stop] = seconds
+            for column, values in data.items():
+                self.file[column][self.rows_written:stop] = values
+        else:
+            table = pyarrow.table(dict([('seconds', seconds)] + list(data.items())))
+            if self.file is None:
+                if self.output_format == 'parquet':
+                    self.file = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+                else:  # feather (version 2) is the Arrow IPC file format
+                    self.file = pyarrow.ipc.new_file(self.path, table.schema)
+            self.file.write_table(table)
+
+        self.rows_written += len(seconds)
+
+    def close(self):
+        if self.output_format == 'npy':
+            for values in (self.file or {}).values():
+                values.flush()
+        elif self.file is not None:
+            self.file.close()
+        self.file = None
+        logging.info('{} {} simulation data written to {}.'.format(self.name, self.mode, self.path))
+
@@ -0,0 +1,42 @@
+import argparse
+import os
+import sys
+
+import modules.benchmarks as benchmarks
+
+# Run the case studies and verification cases in their modes over 1, 7 and 30 days, append the results to the
+# history and compare them with the baseline (the first run's results, or those stored with --update-baseline).
+# Exits with 1 when a benchmark regressed or no longer matches the committed outputs
+HISTORY_PATH = 'output/benchmark_history.json'
+BASELINE_PATH = 'output/benchmark_baseline.json'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', nargs='+', choices=list(benchmarks.CASES))
+    parser.add_argument('--modes', nargs='+', choices=['validation', '1-factor', '2-factor', 'n-factor'])
+    parser.add_argument('--days', nargs='+', type=int)
+    parser.add_argument('--engines', nargs='+', default=['python', 'jit'], choices=['python', 'jit'])
+    parser.add_argument('--integrators', nargs='+', default=['fixed'], choices=['fixed', 'event'])
+    parser.add_argument('--repeat', type=int, default=2,
+                        help='timed runs per benchmark, the outputs of the last are checked against the committed ones')
+    parser.add_argument('--threshold', type=float, default=0.2, help='largest allowed wall time increase')
+    parser.add_argument('--memory-threshold', type=float, default=0.2, help='largest allowed peak RSS increase')
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    os.makedirs('output', exist_ok=True)
+    results = benchmarks.run_suite(benchmarks.get_benchmarks(args.cases, args.modes, args.days, args.engines,
+                                                             args.integrators), args.repeat)
+    benchmarks.append_history(HISTORY_PATH, results)
+
+    if args.update_baseline or not os.path.exists(BASELINE_PATH):
+        benchmarks.save_baseline(BASELINE_PATH, results)
+        print('Baseline stored in {}.'.format(BASELINE_PATH))
+    comparison = benchmarks.compare_with_baseline(results, benchmarks.load_baseline(BASELINE_PATH), args.threshold,
+                                                  args.memory_threshold)
+    print(comparison.to_string(index=False))
+
+    if comparison['Regressed'].any():
+        print('{} benchmarks regressed.'.format(comparison['Regressed'].sum()))
+        sys.exit(1)
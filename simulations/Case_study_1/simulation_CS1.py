@@ -1,5 +1,5 @@
+import modules.loaders as loaders
 import modules.pumpingsystem as ps
-import pandas as pd
 import numpy as np
 
 # Pump schedule as per SCADA. rows = pumps, columns 1:=Peak, 2:=Standard, 3:Off-peak
@@ -9,12 +9,12 @@ pump_schedule_44 = np.array([[80, 50, 30],
                             [150, 150, 150]])
 
 # Inflows into dams
-dam_inflow_profiles = pd.read_csv('input/CS1_dam_inflow_profiles.csv.gz')
-inflow_44 = np.reshape(dam_inflow_profiles['44L Inflow'].values, (24, 2))
+dam_inflow_profiles = loaders.read_table('input/CS1_dam_inflow_profiles.csv.gz')
+inflow_44 = dam_inflow_profiles.get_inflow_profile('44L Inflow')
 
 # Read actual data for initial conditions and validation
-actual_values = pd.read_csv('input/CS1_data_for_validation.csv.gz')
-actual_status_44 = actual_values['44L Status'].values
+actual_values = loaders.read_table('input/CS1_data_for_validation.csv.gz')
+actual_status_44 = actual_values['44L Status']
 initial_level_44 = actual_values['44L Level'][0]
 
 # Create pump system
@@ -26,7 +26,8 @@ pump_system.add_level(ps.PumpingLevel("44L", 5000000, initial_level_44,
 
 
 # Perform simulations
-pump_system.perform_simulation(mode='validation', save=True)
-pump_system.perform_simulation(mode='1-factor', save=True)
-pump_system.perform_simulation(mode='2-factor', save=True)
-pump_system.perform_simulation(mode='n-factor', save=True)
+if __name__ == '__main__':
+    pump_system.perform_simulation(mode='validation', save=True)
+    pump_system.perform_simulation(mode='1-factor', save=True)
+    pump_system.perform_simulation(mode='2-factor', save=True)
+    pump_system.perform_simulation(mode='n-factor', save=True)
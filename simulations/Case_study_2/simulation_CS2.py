@@ -1,5 +1,5 @@
+import modules.loaders as loaders
 import modules.pumpingsystem as ps
-import pandas as pd
 import numpy as np
 
 # Pump schedule as per SCADA. rows = pumps, columns 1:=Peak, 2:=Standard, 3:Off-peak
@@ -15,14 +15,14 @@ pump_schedule_12 = np.array([[80, 30, 30],
                             [150, 150, 150]])
 
 # Inflows into dams
-dam_inflow_profiles = pd.read_csv('input/CS2_dam_inflow_profiles.csv.gz')
-inflow_27 = np.reshape(dam_inflow_profiles['27L Inflow'].values, (24, 2))
-inflow_12 = np.reshape(dam_inflow_profiles['12L Inflow'].values, (24, 2))
+dam_inflow_profiles = loaders.read_table('input/CS2_dam_inflow_profiles.csv.gz')
+inflow_27 = dam_inflow_profiles.get_inflow_profile('27L Inflow')
+inflow_12 = dam_inflow_profiles.get_inflow_profile('12L Inflow')
 
 # Read actual data for initial conditions and validation
-actual_values = pd.read_csv('input/CS2_data_for_validation.csv.gz')
-actual_status_27 = actual_values['27L Status'].values
-actual_status_12 = actual_values['12L Status'].values
+actual_values = loaders.read_table('input/CS2_data_for_validation.csv.gz')
+actual_status_27 = actual_values['27L Status']
+actual_status_12 = actual_values['12L Status']
 initial_level_27 = actual_values['27L Level'][0]
 initial_level_12 = actual_values['12L Level'][0]
 
@@ -39,7 +39,8 @@ pump_system.add_level(ps.PumpingLevel("12L", 3000000, initial_level_12,
 
 
 # Perform simulations
-pump_system.perform_simulation(mode='validation', save=True)
-pump_system.perform_simulation(mode='1-factor', save=True)
-pump_system.perform_simulation(mode='2-factor', save=True)
-pump_system.perform_simulation(mode='n-factor', save=True)
+if __name__ == '__main__':
+    pump_system.perform_simulation(mode='validation', save=True)
+    pump_system.perform_simulation(mode='1-factor', save=True)
+    pump_system.perform_simulation(mode='2-factor', save=True)
+    pump_system.perform_simulation(mode='n-factor', save=True)
@@ -1,5 +1,5 @@
+import modules.loaders as loaders
 import modules.pumpingsystem as ps
-import pandas as pd
 import numpy as np
 
 # Pump schedule as per SCADA. rows = pumps, columns 1:=Peak, 2:=Standard, 3:Off-peak
@@ -24,19 +24,19 @@ pump_schedule_IPC = np.array([[80, 45, 45],
 dummy_pump_schedule_surface = np.array([[150, 150, 150]])
 
 # Inflows into dams
-dam_inflow_profiles = pd.read_csv('input/CS3_dam_inflow_profiles.csv.gz')
-inflow_41 = np.reshape(dam_inflow_profiles['41L Inflow'].values, (24, 2))
-inflow_31 = np.reshape(dam_inflow_profiles['31L Inflow'].values, (24, 2))
-inflow_20 = np.reshape(dam_inflow_profiles['20L Inflow'].values, (24, 2))
-inflow_IPC = np.reshape(dam_inflow_profiles['IPC Inflow'].values, (24, 2))
-inflow_surface = np.reshape(dam_inflow_profiles['Surface Inflow'].values, (24, 2))
+dam_inflow_profiles = loaders.read_table('input/CS3_dam_inflow_profiles.csv.gz')
+inflow_41 = dam_inflow_profiles.get_inflow_profile('41L Inflow')
+inflow_31 = dam_inflow_profiles.get_inflow_profile('31L Inflow')
+inflow_20 = dam_inflow_profiles.get_inflow_profile('20L Inflow')
+inflow_IPC = dam_inflow_profiles.get_inflow_profile('IPC Inflow')
+inflow_surface = dam_inflow_profiles.get_inflow_profile('Surface Inflow')
 
 # Read actual data for initial conditions and validation
-actual_values = pd.read_csv('input/CS3_data_for_validation.csv.gz')
-actual_status_41 = actual_values['41L Status'].values
-actual_status_31 = actual_values['31L Status'].values
-actual_status_20 = actual_values['20L Status'].values
-actual_status_IPC = actual_values['IPC Status'].values
+actual_values = loaders.read_table('input/CS3_data_for_validation.csv.gz')
+actual_status_41 = actual_values['41L Status']
+actual_status_31 = actual_values['31L Status']
+actual_status_20 = actual_values['20L Status']
+actual_status_IPC = actual_values['IPC Status']
 initial_level_41 = actual_values['41L Level'][0]
 initial_level_31 = actual_values['31L Level'][0]
 initial_level_20 = actual_values['20L Level'][0]
@@ -73,7 +73,8 @@ pump_system.add_level(ps.PumpingLevel("Surface", 5000000, initial_level_surface,
 
 
 # Perform simulations
-pump_system.perform_simulation(mode='validation', save=True)
-pump_system.perform_simulation(mode='1-factor', save=True)
-pump_system.perform_simulation(mode='2-factor', save=True)
-pump_system.perform_simulation(mode='n-factor', save=True)
+if __name__ == '__main__':
+    pump_system.perform_simulation(mode='validation', save=True)
+    pump_system.perform_simulation(mode='1-factor', save=True)
+    pump_system.perform_simulation(mode='2-factor', save=True)
+    pump_system.perform_simulation(mode='n-factor', save=True)
@@ -9,4 +9,5 @@ inflow = np.reshape(inflow['0 Inflow'].values, (24, 2))
 pump_system = ps.PumpSystem('M2')
 pump_system.add_level(ps.PumpingLevel('0', 1000000, 10, 0, 0, np.zeros((1, 3)), 0, inflow))
 
-pump_system.perform_simulation('1-factor', save=True)
+if __name__ == '__main__':
+    pump_system.perform_simulation('1-factor', save=True)
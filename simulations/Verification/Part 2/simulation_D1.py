@@ -7,4 +7,5 @@ schedule = np.array([[70, 70, 70],
 pump_system = ps.PumpSystem('D1')
 pump_system.add_level(ps.PumpingLevel('0', 1000000, 0, 15, 0, schedule, 0, 20))
 
-pump_system.perform_simulation('1-factor', save=True)
+if __name__ == '__main__':
+    pump_system.perform_simulation('1-factor', save=True)